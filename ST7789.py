@@ -1,17 +1,89 @@
 
 import time
+import logging
+import threading
+from contextlib import contextmanager
 import config
+import numpy as np
+from PIL import ImageColor
+from pixelformat import rgb565
 
 class ST7789(config.RaspberryPi):
 
     width = 240
     height = 240 
+    _pix = None # Reused RGB565 frame buffer, see _rgb565()
+    _last = None # Copy of what the panel currently shows, for partial updates
+
+    partial_update = False # Only push tiles that changed since the last frame
+    TILE_SIZE = 24 # Must divide width and height
+    PARTIAL_THRESHOLD = 0.5 # Above this fraction of dirty tiles do a full push
+    FILL_CACHE_SIZE = 4 # Number of solid colour blocks kept by FillRect()
+
+    # Panel configuration sent by Init(), as (command, parameter bytes).
+    # Each entry goes out as one command byte plus one SPI write for its parameters.
+    INIT_SEQUENCE = (
+        (0x36, (0x70,)),                        # MADCTL (0x00 in the stock driver)
+        (0x3A, (0x05,)),                        # COLMOD: 16 bit RGB565
+        (0xB2, (0x0C, 0x0C, 0x00, 0x33, 0x33)), # PORCTRL
+        (0xB7, (0x35,)),                        # GCTRL
+        (0xBB, (0x19,)),                        # VCOMS
+        (0xC0, (0x2C,)),                        # LCMCTRL
+        (0xC2, (0x01,)),                        # VDVVRHEN
+        (0xC3, (0x12,)),                        # VRHS
+        (0xC4, (0x20,)),                        # VDVS
+        (0xC6, (0x0F,)),                        # FRCTRL2
+        (0xD0, (0xA4, 0xA1)),                   # PWCTRL1
+        (0xE0, (0xD0, 0x04, 0x0D, 0x11, 0x13, 0x2B, 0x3F,
+                0x54, 0x4C, 0x18, 0x0D, 0x0B, 0x1F, 0x23)), # PVGAMCTRL
+        (0xE1, (0xD0, 0x04, 0x0C, 0x11, 0x13, 0x2C, 0x3F,
+                0x44, 0x51, 0x2F, 0x1F, 0x1F, 0x20, 0x23)), # NVGAMCTRL
+        (0x21, ()),                             # INVON
+        (0x11, ()),                             # SLPOUT
+        (0x29, ()),                             # DISPON
+    )
+    # Lives on tmpfs, so it disappears on reboot/power loss along with the panel config
+    WARM_MARKER = '/dev/shm/st7789.ready'
+    # Called as on_pushed(issued, finished) (time.monotonic()) after each
+    # frame, region or fill that actually sent pixels, e.g. to measure input
+    # latency. issued is when it was asked for: the SubmitFrame()/SubmitImage()
+    # call for writer frames, the start of the transfer for direct ones.
+    on_pushed = None
+    _writes = 0 # spi_writebytes2() calls, to tell whether a transfer sent anything
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Held for every frame transfer so the writer thread and direct
+        # ShowImage() callers never interleave on the bus
+        self.spi_lock = threading.RLock()
+        self._frame_ready = threading.Condition()
+        self._back = None # Newest submitted frame not yet picked up by the writer
+        self._back_rect = None # Changed box of _back, None for the whole frame
+        self._back_issued = None # time.monotonic() _back was submitted
+        self._front_buf = None # RGB565 buffers swapped between SubmitFrame and the writer
+        self._back_buf = None
+        self._writer = None
+        self._generation = 0 # Bumped by every direct show, frames taken before that are stale
+        self.frames_presented = 0
+        self.frames_dropped = 0
+        self._fill_cache = {} # RGB565 value -> full-screen block of that colour
+
+    def spi_writebytes2(self, data):
+        super().spi_writebytes2(data)
+        self._writes += 1
+
     def command(self, cmd):
         self.digital_write(self.GPIO_DC_PIN, False)
         self.spi_writebyte([cmd])      
     def data(self, val):
         self.digital_write(self.GPIO_DC_PIN, True)
         self.spi_writebyte([val])
+    def command_block(self, cmd, params):
+        """Send a command followed by all of its parameters in one SPI write"""
+        self.command(cmd)
+        if params:
+            self.digital_write(self.GPIO_DC_PIN, True)
+            self.spi_writebytes2(bytes(params))
 
     def reset(self):
         """Reset the display"""
@@ -21,127 +93,357 @@ class ST7789(config.RaspberryPi):
         time.sleep(0.01)
         self.digital_write(self.GPIO_RST_PIN,True)
         time.sleep(0.01)
-    def Init(self):
-        """Initialize dispaly"""  
+
+    def _init_signature(self):
+        return repr(self.INIT_SEQUENCE)
+
+    def is_warm(self):
+        """True if this panel was configured with the current INIT_SEQUENCE since boot"""
+        try:
+            with open(self.WARM_MARKER) as fp:
+                return fp.read() == self._init_signature()
+        except OSError:
+            return False
+
+    def Init(self, warm = True):
+        """Initialize dispaly
+
+        With warm=True the hard reset is skipped if a previous run already
+        configured the panel (e.g. after a service restart). The command table
+        is still sent since it is cheap and leaves the panel in a known state.
+        """
         self.module_init()
-        self.reset()
-
-        self.command(0x36)
-        self.data(0x70)                 #self.data(0x00)
-
-        self.command(0x3A) 
-        self.data(0x05)
-
-        self.command(0xB2)
-        self.data(0x0C)
-        self.data(0x0C)
-        self.data(0x00)
-        self.data(0x33)
-        self.data(0x33)
-
-        self.command(0xB7)
-        self.data(0x35) 
-
-        self.command(0xBB)
-        self.data(0x19)
-
-        self.command(0xC0)
-        self.data(0x2C)
-
-        self.command(0xC2)
-        self.data(0x01)
-
-        self.command(0xC3)
-        self.data(0x12)   
-
-        self.command(0xC4)
-        self.data(0x20)
-
-        self.command(0xC6)
-        self.data(0x0F) 
-
-        self.command(0xD0)
-        self.data(0xA4)
-        self.data(0xA1)
-
-        self.command(0xE0)
-        self.data(0xD0)
-        self.data(0x04)
-        self.data(0x0D)
-        self.data(0x11)
-        self.data(0x13)
-        self.data(0x2B)
-        self.data(0x3F)
-        self.data(0x54)
-        self.data(0x4C)
-        self.data(0x18)
-        self.data(0x0D)
-        self.data(0x0B)
-        self.data(0x1F)
-        self.data(0x23)
-
-        self.command(0xE1)
-        self.data(0xD0)
-        self.data(0x04)
-        self.data(0x0C)
-        self.data(0x11)
-        self.data(0x13)
-        self.data(0x2C)
-        self.data(0x3F)
-        self.data(0x44)
-        self.data(0x51)
-        self.data(0x2F)
-        self.data(0x1F)
-        self.data(0x1F)
-        self.data(0x20)
-        self.data(0x23)
-        
-        self.command(0x21)
+        if not (warm and self.is_warm()):
+            self.reset()
 
-        self.command(0x11)
+        for cmd, params in self.INIT_SEQUENCE:
+            self.command_block(cmd, params)
+
+        try:
+            with open(self.WARM_MARKER, 'w') as fp:
+                fp.write(self._init_signature())
+        except OSError:
+            pass
 
-        self.command(0x29)
-  
     def SetWindows(self, Xstart, Ystart, Xend, Yend):
         #set the X coordinates
-        self.command(0x2A)
-        self.data(0x00)               #Set the horizontal starting point to the high octet
-        self.data(Xstart & 0xff)      #Set the horizontal starting point to the low octet
-        self.data(0x00)               #Set the horizontal end to the high octet
-        self.data((Xend - 1) & 0xff) #Set the horizontal end to the low octet 
-        
+        self.command_block(0x2A, (0x00, Xstart & 0xff, 0x00, (Xend - 1) & 0xff))
         #set the Y coordinates
-        self.command(0x2B)
-        self.data(0x00)
-        self.data((Ystart & 0xff))
-        self.data(0x00)
-        self.data((Yend - 1) & 0xff )
+        self.command_block(0x2B, (0x00, Ystart & 0xff, 0x00, (Yend - 1) & 0xff))
 
         self.command(0x2C) 
-        
-    def ShowImage(self,Image):
-        """Set buffer to value of Python Imaging Library image."""
-        """Write display buffer to physical display"""
+
+    def _rgb565(self, Image):
+        """Convert a full-screen PIL image into the reused RGB565 frame buffer"""
+        if self._pix is None:
+            # Allocated once and reused for every frame
+            self._pix = np.zeros((self.height, self.width, 2), dtype = np.uint8)
+            self._tmp = np.zeros((self.height, self.width), dtype = np.uint8)
+        return rgb565(Image, self._pix, self._tmp)
+
+    def _remember(self, pix):
+        """Keep a copy of the frame on the panel so the next one can be diffed"""
+        if not self.partial_update:
+            self._last = None
+            return
+        if self._last is None:
+            self._last = np.empty((self.height, self.width, 2), dtype = np.uint8)
+        self._last.reshape(-1)[:] = np.frombuffer(pix, dtype = np.uint8)
+
+    def _dirty_rects(self, dirty):
+        """Merge a grid of dirty tiles into (x0, y0, x1, y1) pixel rectangles"""
+        T = self.TILE_SIZE
+        rects = []
+        open_rects = {} # (first col, end col) -> rect still growing downwards
+        for r, row in enumerate(dirty):
+            grown = {}
+            c, n = 0, len(row)
+            while c < n:
+                if not row[c]:
+                    c += 1
+                    continue
+                start = c
+                while c < n and row[c]:
+                    c += 1
+                rect = open_rects.pop((start, c), None) or [start * T, r * T, c * T, r * T]
+                rect[3] = (r + 1) * T
+                grown[(start, c)] = rect
+            rects.extend(open_rects.values())
+            open_rects = grown
+        rects.extend(open_rects.values())
+        return rects
+
+    def ShowBuffer(self, buf):
+        """Write a full-frame big-endian RGB565 buffer to the display"""
+        self.SetWindows ( 0, 0, self.width, self.height)
+        self.digital_write(self.GPIO_DC_PIN,True)
+        self.spi_writebytes2(buf)
+        self._remember(buf)
+
+    def ShowPartial(self, pix):
+        """Push only the tiles of an RGB565 (height, width, 2) frame that differ
+        from the last one sent, falling back to a full push when most changed"""
+        if self._last is None:
+            return self.ShowBuffer(pix)
+        T = self.TILE_SIZE
+        changed = pix.view(np.uint16)[...,0] != self._last.view(np.uint16)[...,0]
+        dirty = changed.reshape(self.height // T, T, self.width // T, T).any(axis = (1, 3))
+        ndirty = int(dirty.sum())
+        if ndirty == 0:
+            return
+        if ndirty > dirty.size * self.PARTIAL_THRESHOLD:
+            return self.ShowBuffer(pix)
+        for x0, y0, x1, y1 in self._dirty_rects(dirty.tolist()):
+            self.SetWindows(x0, y0, x1, y1)
+            self.digital_write(self.GPIO_DC_PIN,True)
+            self.spi_writebytes2(np.ascontiguousarray(pix[y0:y1, x0:x1]))
+            self._last[y0:y1, x0:x1] = pix[y0:y1, x0:x1]
+
+    def _check_size(self, Image):
         imwidth, imheight = Image.size
         if imwidth != self.width or imheight != self.height:
             raise ValueError('Image must be same dimensions as display \
                 ({0}x{1}).' .format(self.width, self.height))
-        img = self.np.asarray(Image)
-        pix = self.np.zeros((self.width,self.height,2), dtype = self.np.uint8)
-        pix[...,[0]] = self.np.add(self.np.bitwise_and(img[...,[0]],0xF8),self.np.right_shift(img[...,[1]],5))
-        pix[...,[1]] = self.np.add(self.np.bitwise_and(self.np.left_shift(img[...,[1]],3),0xE0),self.np.right_shift(img[...,[2]],3))
-        pix = pix.flatten().tolist()
-        self.SetWindows ( 0, 0, self.width, self.height)
+
+    def _check_frame(self, pix):
+        if pix.shape != (self.height, self.width, 2):
+            raise ValueError('Frame must be a ({0}, {1}, 2) RGB565 array.'.format(self.height, self.width))
+
+    def _push_rect(self, pix, rect):
+        x0, y0, x1, y1 = rect
+        if x1 <= x0 or y1 <= y0:
+            return
+        self.SetWindows(x0, y0, x1, y1)
         self.digital_write(self.GPIO_DC_PIN,True)
-        for i in range(0,len(pix),4096):
-            self.spi_writebyte(pix[i:i+4096])		
-        
+        # Full-width bands of a contiguous frame are already one contiguous slice
+        self.spi_writebytes2(np.ascontiguousarray(pix[y0:y1, x0:x1]))
+        if self._last is not None:
+            self._last[y0:y1, x0:x1] = pix[y0:y1, x0:x1]
+
+    @contextmanager
+    def _transfer(self, issued = None):
+        # Hold the bus for one frame/region and report when it is done,
+        # unless it turned out to be unchanged and nothing was sent
+        with self.spi_lock:
+            issued = time.monotonic() if issued is None else issued
+            writes = self._writes
+            yield
+            if self.on_pushed is not None and self._writes != writes:
+                self.on_pushed(issued, time.monotonic())
+
+    def _present(self, frame, rect = None, issued = None):
+        """Push a PIL image or an already packed RGB565 frame"""
+        with self._transfer(issued):
+            pix = frame if isinstance(frame, np.ndarray) else self._rgb565(frame)
+            if rect is not None:
+                self._push_rect(pix, rect)
+            elif self.partial_update:
+                self.ShowPartial(pix)
+            else:
+                self.ShowBuffer(pix)
+
+    def _drop_pending(self):
+        # A frame pushed directly supersedes anything still waiting for the writer,
+        # and anything it has taken but not sent yet (see _writer_loop)
+        with self._frame_ready:
+            self._generation += 1
+            if self._back is not None:
+                self._back = None
+                self._back_rect = None
+                self.frames_dropped += 1
+
+    def ShowImage(self,Image):
+        """Set buffer to value of Python Imaging Library image."""
+        """Write display buffer to physical display"""
+        self._check_size(Image)
+        self._drop_pending()
+        self._present(Image)
+
+    def ShowFrame(self, pix, rect = None):
+        """Write a (height, width, 2) RGB565 array, e.g. from rgb565(), to the display.
+
+        If the caller knows only rect = (x0, y0, x1, y1) differs from what the
+        panel shows (e.g. consecutive frames of a compiled animation), only
+        that part is sent, straight from pix.
+        """
+        self._check_frame(pix)
+        self._drop_pending()
+        self._present(pix, rect)
+
+    def ShowRegion(self, Image, x, y):
+        """Write a PIL image smaller than the screen at (x, y), leaving the rest untouched.
+
+        When the panel contents are being tracked only the bounding box of the
+        pixels that actually differ is sent.
+        """
+        w, h = Image.size
+        if x < 0 or y < 0 or x + w > self.width or y + h > self.height:
+            raise ValueError('Region must fit inside the display ({0}x{1}).'.format(self.width, self.height))
+        pix = rgb565(Image)
+        self._drop_pending()
+        with self._transfer():
+            if self._last is not None:
+                last = self._last[y:y+h, x:x+w]
+                changed = pix.view(np.uint16)[...,0] != last.view(np.uint16)[...,0]
+                rows, cols = np.flatnonzero(changed.any(axis = 1)), np.flatnonzero(changed.any(axis = 0))
+                if len(rows) == 0:
+                    return
+                top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+                pix = np.ascontiguousarray(pix[top:bottom, left:right])
+                x, y, w, h = x + left, y + top, right - left, bottom - top
+            self.SetWindows(x, y, x + w, y + h)
+            self.digital_write(self.GPIO_DC_PIN,True)
+            self.spi_writebytes2(pix)
+            if self._last is not None:
+                self._last[y:y+h, x:x+w] = pix
+
+    def _color565(self, color):
+        if isinstance(color, str):
+            color = ImageColor.getrgb(color)
+        r, g, b = color[:3]
+        return ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+
+    def _fill_block(self, value):
+        """Full-screen bytes block of one RGB565 colour, built once per colour"""
+        block = self._fill_cache.pop(value, None)
+        if block is None:
+            block = memoryview(bytes((value >> 8, value & 0xff)) * (self.width * self.height))
+            if len(self._fill_cache) >= self.FILL_CACHE_SIZE:
+                del self._fill_cache[next(iter(self._fill_cache))]
+        self._fill_cache[value] = block # Most recently used last
+        return block
+
+    def FillRect(self, x0, y0, x1, y1, color):
+        """Fill x0 <= x < x1, y0 <= y < y1 with a solid colour (RGB tuple or PIL colour name).
+
+        Areas the panel is known to show in that colour already are skipped.
+        """
+        if x1 <= x0 or y1 <= y0:
+            return
+        value = self._color565(color)
+        self._drop_pending()
+        with self._transfer():
+            if self._last is not None and (self._last.view('>u2')[y0:y1, x0:x1, 0] == value).all():
+                return
+            self.SetWindows(x0, y0, x1, y1)
+            self.digital_write(self.GPIO_DC_PIN,True)
+            self.spi_writebytes2(self._fill_block(value)[:(x1 - x0) * (y1 - y0) * 2])
+            if self._last is None and self.partial_update and (x1 - x0, y1 - y0) == (self.width, self.height):
+                self._last = np.empty((self.height, self.width, 2), dtype = np.uint8)
+            if self._last is not None:
+                self._last[y0:y1, x0:x1] = (value >> 8, value & 0xff)
+
+    def ShowOnBlack(self, Image):
+        """ShowImage() for screens drawn on a black background.
+
+        The margins around the content go out as cached solid fills, and only
+        the bounding box of the non-black pixels is converted and sent. In
+        partial_update mode this is the same as ShowImage().
+        """
+        self._check_size(Image)
+        self._drop_pending()
+        bbox = Image.getbbox()
+        with self.spi_lock:
+            if self.partial_update:
+                # The tile diff already skips margins that are black on the panel
+                return self._present(Image)
+            if bbox is None:
+                return self.FillRect(0, 0, self.width, self.height, (0, 0, 0))
+            x0, y0, x1, y1 = bbox
+            self.FillRect(0, 0, self.width, y0, (0, 0, 0))
+            self.FillRect(0, y1, self.width, self.height, (0, 0, 0))
+            self.FillRect(0, y0, x0, y1, (0, 0, 0))
+            self.FillRect(x1, y0, self.width, y1, (0, 0, 0))
+            self.ShowRegion(Image.crop(bbox), x0, y0)
+
+    def SubmitImage(self, Image):
+        """Queue an image for the writer thread and return immediately.
+
+        Only the newest frame is kept: if the writer has not picked up the
+        previous submission yet, that frame is dropped. Falls back to a
+        blocking ShowImage() if start_writer() was not called.
+        """
+        if self._writer is None:
+            return self.ShowImage(Image)
+        self._check_size(Image)
+        with self._frame_ready:
+            if self._back is not None:
+                self.frames_dropped += 1
+            self._back = Image
+            self._back_rect = None
+            self._back_issued = time.monotonic()
+            self._frame_ready.notify()
+
+    def SubmitFrame(self, pix, rect = None):
+        """SubmitImage() for an RGB565 frame array, rect as for ShowFrame().
+
+        The frame is copied into the writer's back buffer, so the caller may
+        reuse or modify pix as soon as this returns.
+        """
+        if self._writer is None:
+            return self.ShowFrame(pix, rect)
+        self._check_frame(pix)
+        with self._frame_ready:
+            if self._back is not None:
+                self.frames_dropped += 1
+                # The dropped frame's changes never reached the panel, so cover them too
+                rect = None if rect is None or self._back_rect is None else (
+                    min(rect[0], self._back_rect[0]), min(rect[1], self._back_rect[1]),
+                    max(rect[2], self._back_rect[2]), max(rect[3], self._back_rect[3]))
+            self._back_rect = rect
+            if self._back_buf is None:
+                self._back_buf = np.empty_like(pix)
+            np.copyto(self._back_buf, pix)
+            self._back = self._back_buf
+            self._back_issued = time.monotonic()
+            self._frame_ready.notify()
+
+    def _writer_loop(self):
+        while True:
+            with self._frame_ready:
+                while self._back is None and self._writer is not None:
+                    self._frame_ready.wait()
+                if self._writer is None:
+                    return
+                frame, self._back = self._back, None
+                rect, self._back_rect = self._back_rect, None
+                issued = self._back_issued
+                generation = self._generation
+                if frame is self._back_buf:
+                    # The writer now owns this buffer, SubmitFrame fills the other one
+                    self._front_buf, self._back_buf = self._back_buf, self._front_buf
+            try:
+                with self.spi_lock:
+                    if generation != self._generation:
+                        # A direct show got the bus in between, don't cover it up
+                        self.frames_dropped += 1
+                        continue
+                    self._present(frame, rect, issued)
+                self.frames_presented += 1
+            except Exception:
+                logging.exception("Display writer failed to push frame")
+
+    def start_writer(self):
+        """Start the background thread that pushes frames given to SubmitImage()"""
+        with self._frame_ready:
+            if self._writer is not None:
+                return
+            self._writer = threading.Thread(target = self._writer_loop, name = 'st7789-writer', daemon = True)
+            self._writer.start()
+
+    def stop_writer(self):
+        """Stop the writer thread, discarding any frame it has not started on"""
+        with self._frame_ready:
+            writer, self._writer = self._writer, None
+            self._back = None
+            self._frame_ready.notify()
+        if writer is not None:
+            writer.join()
+
+    def writer_stats(self):
+        return {'presented': self.frames_presented, 'dropped': self.frames_dropped}
+
     def clear(self):
         """Clear contents of image buffer"""
-        _buffer = [0xff]*(self.width * self.height * 2)
-        self.SetWindows ( 0, 0, self.width, self.height)
-        self.digital_write(self.GPIO_DC_PIN,True)
-        for i in range(0,len(_buffer),4096):
-            self.spi_writebyte(_buffer[i:i+4096])	        
+        self.FillRect(0, 0, self.width, self.height, (255, 255, 255))
         
-
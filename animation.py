@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import mmap
+import time
+import struct
+import logging
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from PIL import Image, ImageSequence
+from pixelformat import rgb565
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FRAME_DURATION = 0.1 # Seconds, used when a GIF frame has no (or a zero) duration
+
+def frame_duration(frame) -> float:
+    """Display time in seconds from the GIF 'duration' field (ms)"""
+    return (frame.info.get('duration') or DEFAULT_FRAME_DURATION * 1000) / 1000
+
+def decode_gif(path, size):
+    """Resized RGB565 frames and their durations, decoded through PIL"""
+    gif = Image.open(path)
+    frames, durations = [], []
+    for frame in ImageSequence.Iterator(gif):
+        durations.append(frame_duration(frame))
+        frames.append(rgb565(frame.resize(size)))
+    return frames, durations
+
+def frame_rects(frames) -> list[tuple]:
+    """(x0, y0, x1, y1) box of the pixels each frame changes from the one
+    before it, wrapping around so frame 0 is diffed against the last frame"""
+    rects = []
+    for prev, frame in zip(frames[-1:] + frames[:-1], frames):
+        changed = (frame != prev).any(axis = 2)
+        rows, cols = np.flatnonzero(changed.any(axis = 1)), np.flatnonzero(changed.any(axis = 0))
+        if len(rows) == 0:
+            rects.append((0, 0, 0, 0))
+        else:
+            rects.append((int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1))
+    return rects
+
+@dataclass
+class Animation:
+    """Resized animation frames as (h, w, 2) RGB565 arrays.
+
+    Frames are either decoded GIF frames held in memory or read-only views
+    into a memory-mapped compiled file (see compile_animation).
+    """
+    frames: list
+    durations: list[float]
+    size: tuple
+    rects: list
+    mapped: bool = False
+
+    @property
+    def nbytes(self) -> int:
+        """Memory this animation pins; mapped frames live in the page cache"""
+        return 0 if self.mapped else sum(f.nbytes for f in self.frames)
+
+    def changed_rect(self, prev, i):
+        """Box that has to be redrawn to go from frame `prev` to frame `i`
+        (frames in between may have been skipped), None for the whole frame"""
+        if prev is None:
+            return None
+        n = len(self.frames)
+        x0, y0, x1, y1 = self.size[0], self.size[1], 0, 0
+        k = prev
+        while k != i:
+            k = (k + 1) % n
+            rx0, ry0, rx1, ry1 = self.rects[k]
+            if rx1 > rx0:
+                x0, y0, x1, y1 = min(x0, rx0), min(y0, ry0), max(x1, rx1), max(y1, ry1)
+        return (x0, y0, x1, y1) if x1 > x0 else (0, 0, 0, 0)
+
+def load_animation(path, size) -> Animation:
+    """Load `path` at `size`, from its compiled file if one is up to date"""
+    compiled = compiled_path(path, size)
+    try:
+        if os.path.getmtime(compiled) >= os.path.getmtime(path):
+            return map_animation(compiled)
+    except OSError:
+        pass
+    except ValueError:
+        logger.exception(f"Ignoring bad compiled animation {compiled}")
+    frames, durations = decode_gif(path, size)
+    return Animation(frames, durations, tuple(size), frame_rects(frames))
+
+# Compiled animation file: header, one table entry per frame, then the raw
+# big-endian RGB565 frames back to back starting at a page boundary
+MAGIC = b'CGA1'
+HEADER = struct.Struct('<4sHHH') # magic, width, height, frame count
+FRAME_ENTRY = struct.Struct('<HHHHH') # duration ms, changed rect x0, y0, x1, y1
+
+def compiled_path(path, size) -> str:
+    return f'{path}.{size[0]}x{size[1]}.rgb565'
+
+def _data_offset(nframes) -> int:
+    end = HEADER.size + FRAME_ENTRY.size * nframes
+    return -(-end // mmap.PAGESIZE) * mmap.PAGESIZE
+
+def compile_animation(path, size, dest = None) -> str:
+    """Decode a GIF once and write it out in the compiled format"""
+    frames, durations = decode_gif(path, size)
+    rects = frame_rects(frames)
+    dest = dest or compiled_path(path, size)
+    tmp = dest + '.tmp'
+    with open(tmp, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, size[0], size[1], len(frames)))
+        for duration, rect in zip(durations, rects):
+            fp.write(FRAME_ENTRY.pack(round(duration * 1000), *rect))
+        fp.seek(_data_offset(len(frames)))
+        for frame in frames:
+            fp.write(frame.tobytes())
+    os.replace(tmp, dest)
+    return dest
+
+def map_animation(path) -> Animation:
+    """Memory-map a compiled animation; frames are zero-copy views of the file"""
+    with open(path, 'rb') as fp:
+        mm = mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ)
+    magic, width, height, nframes = HEADER.unpack_from(mm, 0)
+    if magic != MAGIC:
+        raise ValueError(f'{path} is not a compiled animation')
+    frame_bytes = width * height * 2
+    offset = _data_offset(nframes)
+    if len(mm) < offset + frame_bytes * nframes:
+        raise ValueError(f'{path} is truncated')
+    durations, rects, frames = [], [], []
+    for i in range(nframes):
+        duration, *rect = FRAME_ENTRY.unpack_from(mm, HEADER.size + FRAME_ENTRY.size * i)
+        durations.append(duration / 1000)
+        rects.append(tuple(rect))
+        frames.append(np.frombuffer(mm, dtype = np.uint8, count = frame_bytes, offset = offset + frame_bytes * i).reshape(height, width, 2))
+    return Animation(frames, durations, (width, height), rects, mapped = True)
+
+class AnimationCache:
+    """Decoded animations keyed by (path, size), evicted least recently used
+    first once their RGB565 frames exceed `budget` bytes"""
+
+    def __init__(self, budget = 24 * 1024 * 1024):
+        self.budget = budget
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, path, size) -> Animation:
+        key = (path, tuple(size))
+        with self._lock:
+            anim = self._entries.get(key)
+            if anim is not None:
+                self._entries.move_to_end(key)
+                return anim
+        # Load outside the lock, the home and interact screens may both be loading
+        anim = load_animation(path, key[1])
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = anim
+                self.nbytes += anim.nbytes
+            else:
+                self._entries.move_to_end(key)
+            while self.nbytes > self.budget and len(self._entries) > 1:
+                old_key, old = self._entries.popitem(last = False)
+                self.nbytes -= old.nbytes
+                logger.debug(f"Evicted animation {old_key} from cache")
+            return self._entries[key]
+
+class Compositor:
+    """Layers an animation frame over a static background, all in RGB565.
+
+    The background (e.g. the home screen HUD) is only re-rendered when its
+    key changes, and only copied into the output when it or the frame's
+    placement changed, so a steady-state frame costs one paste.
+    """
+
+    def __init__(self, width, height):
+        self.key = None
+        self._background = np.zeros((height, width, 2), dtype = np.uint8)
+        self._out = np.zeros((height, width, 2), dtype = np.uint8)
+        self._placement = None
+
+    def set_background(self, key, render):
+        """Use render() -> PIL image as the background unless key is unchanged"""
+        if key != self.key:
+            rgb565(render(), self._background)
+            self.key = key
+            self._placement = None
+
+    def compose(self, frame, x, y):
+        """Output frame with `frame` pasted at (x, y); reused between calls"""
+        placement = (x, y, frame.shape[1], frame.shape[0])
+        if placement != self._placement:
+            np.copyto(self._out, self._background)
+            self._placement = placement
+        self._out[y:y + frame.shape[0], x:x + frame.shape[1]] = frame
+        return self._out
+
+class FrameScheduler:
+    """Paces an animation against wall-clock deadlines from its frame durations.
+
+    Frames whose slot has already passed are skipped, so a slow frame makes
+    the animation drop frames instead of playing in slow motion. The minimum
+    time between two shown frames starts at `min_interval` and is raised
+    towards `max_interval` while rendering can't keep up or the CPU is
+    saturated (e.g. during a PSD packet flood), then relaxed again.
+
+    Waiting goes through `sleep`, e.g. RenderLoop.sleep so the render thread
+    keeps handling commands between frames.
+    """
+
+    def __init__(self, min_interval = 0.05, max_interval = 0.25, cpu_threshold = 0.9, sleep = time.sleep):
+        self.base_interval = min_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.cpu_threshold = cpu_threshold
+        self.sleep = sleep
+        self.shown = 0
+        self.skipped = 0
+        self._next_allowed = 0
+        self._sample = (time.monotonic(), time.process_time())
+        self._saturated = False
+
+    def _cpu_saturated(self) -> bool:
+        now, cpu = time.monotonic(), time.process_time()
+        if now - self._sample[0] >= 1.0:
+            ncpu = os.cpu_count() or 1
+            share = (cpu - self._sample[1]) / (now - self._sample[0]) / ncpu
+            saturated = share > self.cpu_threshold or os.getloadavg()[0] > ncpu
+            if saturated != self._saturated:
+                logger.info(f"CPU {'saturated' if saturated else 'idle again'}, frame interval {self.min_interval:.3f}s")
+            self._saturated = saturated
+            self._sample = (now, cpu)
+        return self._saturated
+
+    def _adapt(self, render_time):
+        if render_time > self.min_interval * 0.8 or self._cpu_saturated():
+            self.min_interval = min(self.min_interval * 1.25, self.max_interval)
+        else:
+            self.min_interval = max(self.min_interval * 0.95, self.base_interval)
+
+    def play(self, durations):
+        """Yield the indices of the frames to render for one pass of the animation.
+
+        The caller renders frame i when it is yielded; the scheduler sleeps
+        until the next frame is due and returns once the last frame's time
+        is up.
+        """
+        slot = time.monotonic()
+        for i, duration in enumerate(durations):
+            start, slot = slot, slot + duration
+            at = max(start, self._next_allowed)
+            if at >= slot or time.monotonic() >= slot:
+                self.skipped += 1
+                continue
+            self.sleep(max(at - time.monotonic(), 0))
+            began = time.monotonic()
+            yield i
+            self.shown += 1
+            self._adapt(time.monotonic() - began)
+            self._next_allowed = began + self.min_interval
+        self.sleep(max(slot - time.monotonic(), 0))
+
+if __name__ == '__main__':
+    # Offline compile step, run from install.sh:
+    #   python animation.py 190x190 media/gifs/*.gif
+    if len(sys.argv) < 3:
+        print(f"Usage: {sys.argv[0]} WIDTHxHEIGHT GIF...")
+        sys.exit(1)
+    size = tuple(int(v) for v in sys.argv[1].split('x'))
+    for gif in sys.argv[2:]:
+        print(f"{gif} -> {compile_animation(gif, size)}")
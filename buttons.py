@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import time
+import bisect
+import threading
+import gpiozero
+from collections import deque
+
+class LatencyHistogram:
+    """Counts of latencies (seconds) in fixed millisecond buckets"""
+
+    BOUNDS_MS = (10, 20, 35, 50, 75, 100, 150, 250, 500, 1000)
+
+    def __init__(self, target_ms = 100):
+        self.target_ms = target_ms
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1) # Last bucket: over the largest bound
+        self.total = 0
+        self.worst = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.BOUNDS_MS, seconds * 1000)] += 1
+            self.total += 1
+            self.worst = max(self.worst, seconds)
+
+    def percentile(self, p):
+        """Upper bound in ms of the bucket holding the p-th percentile, None if
+        there are no samples or it lies beyond the largest bound"""
+        with self._lock:
+            if self.total == 0:
+                return None
+            seen = 0
+            for bound, count in zip(self.BOUNDS_MS, self.counts):
+                seen += count
+                if seen >= self.total * p / 100:
+                    return bound
+            return None
+
+    def within_target(self):
+        """Fraction of samples at or under target_ms"""
+        with self._lock:
+            if self.total == 0:
+                return 1.0
+            n = bisect.bisect_right(self.BOUNDS_MS, self.target_ms)
+            return sum(self.counts[:n]) / self.total
+
+    def __str__(self):
+        buckets = ' '.join(f'<={b}:{c}' for b, c in zip(self.BOUNDS_MS, self.counts) if c)
+        if self.counts[-1]:
+            buckets += f' >{self.BOUNDS_MS[-1]}:{self.counts[-1]}'
+        return (f'n={self.total} p50<={self.percentile(50)}ms p95<={self.percentile(95)}ms '
+                f'worst={self.worst * 1000:.0f}ms <={self.target_ms}ms:{self.within_target():.0%} [{buckets}]')
+
+class ButtonInput:
+    """Turns gpiozero presses into handler(pin, count) calls on the UI runtime.
+
+    gpiozero's callback thread only timestamps the press and queues it; the
+    handler runs wherever `post` sends it (RenderLoop.post). Presses on the
+    same pin within `debounce` seconds are contact bounce and dropped.
+    Presses of a `coalesce` pin (Up/Down) that arrive while the previous one
+    is still queued are folded into it, so the handler redraws once with
+    count > 1 instead of once per press.
+
+    Assign pushed to the display's on_pushed to record button-to-photon
+    latency: from each press to the end of the first display transfer that
+    was issued after its handler ran. Writer frames submitted before that
+    (e.g. the next frame of a running animation) don't count. The handler
+    returns whether it redrew the screen; presses it didn't redraw for are
+    counted as no_redraw straight away instead of waiting for a transfer.
+    """
+
+    PHOTON_TIMEOUT = 2.0 # Presses with no transfer within this are not recorded
+
+    def __init__(self, pins, handler, post, coalesce = (), debounce = 0.03):
+        self.pins = pins
+        self.handler = handler
+        self.post = post
+        self.coalesce = set(coalesce)
+        self.debounce = debounce
+        self.latency = LatencyHistogram()
+        self.presses = 0
+        self.bounces = 0
+        self.coalesced = 0
+        self.no_redraw = 0
+        self._last_press = {}
+        self._queued = deque() # [pin, press timestamps] waiting for the handler
+        self._awaiting = [] # (press timestamps, handled at) waiting for a transfer
+        self._lock = threading.Lock()
+        self._buttons = []
+
+    def start(self):
+        for pin in self.pins:
+            button = gpiozero.Button(pin)
+            button.when_pressed = lambda button, pin = pin: self.pressed(pin)
+            self._buttons.append(button)
+
+    def pressed(self, pin, at = None):
+        """Record a press, from any thread"""
+        at = time.monotonic() if at is None else at
+        with self._lock:
+            if at - self._last_press.get(pin, -self.debounce) < self.debounce:
+                self.bounces += 1
+                return
+            self._last_press[pin] = at
+            self.presses += 1
+            if pin in self.coalesce and self._queued and self._queued[-1][0] == pin:
+                self._queued[-1][1].append(at)
+                self.coalesced += 1
+                return
+            self._queued.append([pin, [at]])
+        self.post(self._dispatch)
+
+    def _dispatch(self):
+        with self._lock:
+            pin, presses = self._queued.popleft()
+        redrew = False
+        try:
+            redrew = self.handler(pin, len(presses))
+        finally:
+            with self._lock:
+                if redrew:
+                    self._awaiting.append((presses, time.monotonic()))
+                else:
+                    self.no_redraw += len(presses)
+
+    def pushed(self, issued, finished):
+        """Display transfer hook (ST7789.on_pushed)"""
+        with self._lock:
+            if not self._awaiting:
+                return
+            waiting = []
+            for presses, handled in self._awaiting:
+                if finished - handled > self.PHOTON_TIMEOUT:
+                    self.no_redraw += len(presses)
+                elif issued >= handled:
+                    for at in presses:
+                        self.latency.record(finished - at)
+                else:
+                    waiting.append((presses, handled))
+            self._awaiting = waiting
+
+    def stats(self):
+        return {'presses': self.presses, 'bounces': self.bounces, 'coalesced': self.coalesced,
+                'no_redraw': self.no_redraw, 'latency': str(self.latency)}
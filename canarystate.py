@@ -7,7 +7,12 @@ import requests
 from dotenv import load_dotenv
 import logging
 import canarytools
-from copy import deepcopy
+import incidents
+import inventory
+from jsonstream import StreamedObject
+from polling import PollScheduler, Endpoint
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from dataclasses import dataclass
 from datetime import datetime
 from threading import Lock
@@ -21,6 +26,19 @@ auth_token = os.environ['API_KEY']
 
 console = canarytools.Console(console_hash, auth_token)
 
+# CONSOLE_URL points everything at another console API, e.g. mockconsole.py
+api_root = os.environ.get('CONSOLE_URL', f'https://{console_hash}.canary.tools').rstrip('/') + '/api/v1/'
+canarytools.console.ROOT = api_root
+
+# One keep-alive connection pool for every console call, shared with
+# canarytools so its requests reuse the same TLS connections as _get().
+# A poll makes FETCH_WORKERS independent calls, fetched concurrently.
+FETCH_WORKERS = 5
+session = getattr(console, 'session', None) or requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=FETCH_WORKERS))
+console.session = session
+fetch_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='console-fetch')
+
 STATE_FILE = 'cgstate.dat'
 
 state_lock = Lock()
@@ -39,7 +57,8 @@ console_state = {
     'live_devices': 0,
     'dead_devices': 0,
     'bare_devices': 0, # no services enabled
-    'unacked_incidents': [],
+    'device_index': None, # device id -> inventory.device_state(), None until the first scan
+    'unacked': incidents.IncidentIndex(),
     'attacks': []
 }
 
@@ -49,7 +68,8 @@ if sf.is_file():
         state = pickle.load(fp)
         # OR the dicts below so we update structure on save if we ever change them.
         canarygotchi_state = canarygotchi_state | state['cgs']
-        console_state = console_state | state['cs']
+        # Keys we no longer use are dropped (the incident list before IncidentIndex), not carried along
+        console_state = console_state | {k: v for k, v in state['cs'].items() if k in console_state}
 
 def save_state(cgs = canarygotchi_state, cs = console_state):
     state = {
@@ -61,81 +81,94 @@ def save_state(cgs = canarygotchi_state, cs = console_state):
         pickle.dump(state, fp)
     state_lock.release()
 
-def capi(uri):
-
-    try:
-        res = requests.get(f'https://{console_hash}.canary.tools/api/v1/{uri}', data={'auth_token': auth_token})
-        if not res.ok:
-            logger.error(f"Failed call api: {res.reason}: {res.content}")
-            return None
-        return res.json()
-    except:
-        logger.exception("Failed to call console API")
-        return None
-
-
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limited by console, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+def _check(res):
+    """Raise RateLimited on a 429 and HTTPError on other failures"""
+    if res.status_code == 429:
+        try:
+            retry_after = float(res.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            retry_after = None
+        raise RateLimited(retry_after)
+    if not res.ok:
+        raise requests.HTTPError(f"Failed call api: {res.reason}: {res.content}", response=res)
+
+def _get(uri, **params):
+    """GET a console API endpoint"""
+    res = session.get(api_root + uri, data={'auth_token': auth_token, **params})
+    _check(res)
+    return res.json()
+
+def _stream(uri, key, **params):
+    """GET a console API endpoint whose `key` member is a long list, as a
+    StreamedObject that decodes it one element at a time as it arrives"""
+    res = session.get(api_root + uri, data={'auth_token': auth_token, **params}, stream=True)
+    _check(res)
+    return StreamedObject(res.iter_content(16384), key)
+
+# Each endpoint is polled on its own schedule (see polling.PollScheduler):
+# incidents matter most, license and token counts hardly ever change
+poll_schedule = PollScheduler({
+    'incidents': Endpoint(fast=10, slow=30),
+    'devices': Endpoint(fast=60, slow=300),
+    'tokens': Endpoint(fast=120, slow=900),
+    'license': Endpoint(fast=600, slow=3600),
+})
+
+def _fetch_license(previous_state):
+    return {'num_unused_licenses': _get('license/detailed/info').get('canaryvm_remaining_licenses', 0)}
+
+def _fetch_tokens(previous_state):
+    # canarytokens/fetch already lists every token, no need for console.tokens.all() as well
+    return {'num_deployed_tokens': len(_get('canarytokens/fetch').get('tokens', []))}
+
+def _fetch_devices(previous_state):
+    # Straight from devices/all: console.devices.all() asks device/getinfo for every device
+    counts, index, changes = inventory.scan(_stream, previous_state['device_index'])
+    return counts | {'device_index': index, 'device_changes': changes}
+
+def _fetch_incidents(previous_state):
+    index = incidents.sync(_stream, console_hash, previous_state['unacked'])
+    for u in index.newest():
+        logger.debug(f"Unacknowledged: {u['id']} @ {u['title']}")
+    return {'unacked': index}
+
+FETCHERS = {
+    'incidents': _fetch_incidents,
+    'devices': _fetch_devices,
+    'tokens': _fetch_tokens,
+    'license': _fetch_license,
+}
 
 def get_console_state(previous_state = console_state) -> dict:
-    global console_state
-    url = f"https://{console_hash}.canary.tools"
-    res = requests.get(url + '/api/v1/license/detailed/info', data={'auth_token': auth_token})
-    if res.status_code != 200:
-        print("Error fetching console state! " + res.text)
-        return {}
-    new_state = deepcopy(previous_state)
-    new_state['num_unused_licenses'] = res.json().get('canaryvm_remaining_licenses', 0)
-    res = requests.get(url + '/api/v1/canarytokens/fetch', data={'auth_token': auth_token})
-    if res.status_code != 200:
-        print("Error fetching console state! " + res.text)
-        return {}
-    try:
-        new_state['num_deployed_tokens'] = len(console.tokens.all())
-    except canarytools.CanaryTokenError:
-        logger.exception("Failed to get canarytokens from console")
-
-    try:
-        all_devices = console.devices.all()
-        new_state.update({
-            "live_devices": len([d for d in all_devices if d.live]),
-            "dead_devices": len([d for d in all_devices if not d.live]),
-            "bare_devices": len([d for d in all_devices if d.service_count == 0])
-        })
-    except Exception:
-        logger.exception("Failed to live/dead device counts")
-
-    #unacknowledged = console.incidents.unacknowledged()
-    #last_ten_unacked = sorted(unacknowledged, key=lambda d: d.created_std)[-10:]
-    #new_state['unacked_incidents'] = last_ten_unacked[::-1] # Newest first
-    data = capi("incidents/unacknowledged")
-    new_alerts = []
-    for incident in data["incidents"]:
-        # Extract necessary fields
-        incident_summary = incident["summary"]
-        incident_name = incident["description"]["name"]
-        incident_memo = incident["description"].get("memo", "No memo available")  # Default if "memo" key doesn't exist
-        incident_id = incident["id"]
-        incident_hash = incident["hash_id"]
-
-        # Determine the title based on the incident_name
-        # Super limited space on the screen, so we need to shorten stuff
-        if incident_name == "N/A": # incident from canarytoken
-            incident_title = f"Token: {incident_memo[:20]}"
-        else: #incident from Canary
-            incident_title = f"{incident_name}: {incident_summary[:20]}"
-
-        # Create the incident dictionary
-        new_alerts.append({
-            "title": incident_title,
-            "id": incident_id,
-            "hash": incident_hash
-        })
-    new_state['unacked_incidents'] = new_alerts[::-1]
-
-    for u in new_state['unacked_incidents']:
-        #logger.info(f"Unacknowledged: {u.summary} @ {u.created_std}")
-        logger.info(f"Unacknowledged: {u['id']} @ {u['title']}")
-
+    """Poll the endpoints that are due and return previous_state updated with them.
+    device_changes holds the inventory.DeviceChanges this poll found.
+
+    Values in a console state are replaced, never modified, so states share
+    them: compare two with IncidentIndex.diff() rather than copying."""
+    # Independent calls all go out at once, a poll takes as long as the slowest one
+    due = poll_schedule.due()
+    fetches = {name: fetch_pool.submit(FETCHERS[name], previous_state) for name in due}
+
+    new_state = dict(previous_state)
+    new_state['device_changes'] = []
+    for name, fetch in fetches.items():
+        try:
+            update = fetch.result()
+        except RateLimited as e:
+            logger.warning(f"Polling {name}: {e}")
+            poll_schedule.failed(name, e.retry_after)
+            continue
+        except Exception:
+            logger.exception(f"Failed to poll {name} from console")
+            poll_schedule.failed(name)
+            continue
+        changed = any(new_state.get(k) != v for k, v in update.items()
+                      if k not in ('device_index', 'device_changes')) or bool(update.get('device_changes'))
+        new_state.update(update)
+        poll_schedule.done(name, changed)
     return new_state
-
-
-
@@ -56,7 +56,8 @@ class RaspberryPi:
         self.SPEED  =spi_freq
         self.BL_freq=bl_freq
 
-        self.GPIO_RST_PIN= self.gpio_mode(rst,self.OUTPUT)
+        # RST idles high so opening the pins does not reset an already configured panel
+        self.GPIO_RST_PIN= self.gpio_mode(rst,self.OUTPUT,initial_value = True)
         self.GPIO_DC_PIN = self.gpio_mode(dc,self.OUTPUT)
         self.GPIO_BL_PIN = self.gpio_pwm(bl)
         self.bl_DutyCycle(0)
@@ -83,9 +84,9 @@ class RaspberryPi:
             self.SPI.max_speed_hz = spi_freq
             self.SPI.mode = 0b00
 
-    def gpio_mode(self,Pin,Mode,pull_up = None,active_state = True):
+    def gpio_mode(self,Pin,Mode,pull_up = None,active_state = True,initial_value = False):
         if Mode:
-            return DigitalOutputDevice(Pin,active_high = True,initial_value =False)
+            return DigitalOutputDevice(Pin,active_high = True,initial_value =initial_value)
         else:
             return DigitalInputDevice(Pin,pull_up=pull_up,active_state=active_state)
 
@@ -108,6 +109,12 @@ class RaspberryPi:
         if self.SPI!=None :
             self.SPI.writebytes(data)
 
+    def spi_writebytes2(self, data):
+        # Takes any buffer (bytes, memoryview, numpy array) and lets spidev
+        # split it into transfers, so no Python int list is built
+        if self.SPI!=None :
+            self.SPI.writebytes2(data)
+
     def bl_DutyCycle(self, duty):
         self.GPIO_BL_PIN.value = duty / 100
 
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import time
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 50 # Incidents per console API request
+MAX_ALERTS = 50 # Newest unacknowledged incidents kept for the alert list
+# Seconds between full unacknowledged listings. Incremental syncs miss incidents
+# deleted on the console, the full one drops anything the console no longer lists.
+FULL_SYNC_INTERVAL = 1800
+
+def alert_from_incident(incident) -> dict:
+    """Short on-screen alert for a console API incident"""
+    incident_summary = incident["summary"]
+    incident_name = incident["description"]["name"]
+    incident_memo = incident["description"].get("memo", "No memo available")  # Default if "memo" key doesn't exist
+
+    # Super limited space on the screen, so we need to shorten stuff
+    if incident_name == "N/A": # incident from canarytoken
+        incident_title = f"Token: {incident_memo[:20]}"
+    else: #incident from Canary
+        incident_title = f"{incident_name}: {incident_summary[:20]}"
+
+    return {
+        "title": incident_title,
+        "id": incident["id"],
+        "hash": incident["hash_id"]
+    }
+
+def is_acknowledged(incident) -> bool:
+    # The console sends "True"/"False" strings
+    return str(incident.get("acknowledged", False)).lower() == "true"
+
+def incident_key(incident_hash) -> int:
+    """Compact, restart-stable 64-bit key for an incident hash"""
+    return int.from_bytes(hashlib.blake2b(incident_hash.encode(), digest_size = 8).digest(), 'big')
+
+def fetch_pages(stream, uri, key = "incidents", page_size = PAGE_SIZE, **params):
+    """Yield each page of uri as a jsonstream.StreamedObject over its `key` list,
+    following the console's cursor pagination"""
+    page = stream(uri, key, limit = page_size, **params)
+    while True:
+        yield page
+        next_cursor = (page.drain().get("cursor") or {}).get("next")
+        if not next_cursor:
+            return
+        page = stream(uri, key, cursor = next_cursor)
+
+class IncidentIndex:
+    """Every unacknowledged incident by incident_key(), with alerts for the
+    newest MAX_ALERTS of them.
+
+    Only incidents the console has listed are in here, see main.py for
+    webhook alerts. An index is never modified once made, sync() returns a
+    new one. Console states can share it instead of deep copying, and two
+    states are compared with diff().
+    """
+
+    full_synced = 0.0 # time.time() of the last full listing; class default for indexes saved before it existed
+
+    def __init__(self, keys = None, alerts = None, cursor = None, full_synced = 0.0):
+        self.keys = keys if keys is not None else set()
+        self.alerts = alerts if alerts is not None else {} # incident_key -> alert, oldest first
+        self.cursor = cursor # (console_hash, updated_id) this index is in sync with, None before the first sync
+        self.full_synced = full_synced
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, incident_hash):
+        return incident_key(incident_hash) in self.keys
+
+    def __eq__(self, other):
+        # Ignores the cursor: same incidents, nothing to show or score
+        return isinstance(other, IncidentIndex) and self.keys == other.keys and self.alerts == other.alerts
+
+    @property
+    def synced(self) -> bool:
+        """False for an index no sync() has filled yet, e.g. after an upgrade"""
+        # A sync can drop the cursor to force a full fetch, but it always sets full_synced or a cursor
+        return self.cursor is not None or self.full_synced != 0
+
+    def newest(self) -> list:
+        """Alerts, newest first"""
+        return list(reversed(self.alerts.values()))
+
+    def diff(self, previous):
+        """(added, removed) keys since the previous index"""
+        if self.keys is previous.keys:
+            return set(), set()
+        return self.keys - previous.keys, previous.keys - self.keys
+
+def sync(stream, console_hash, index):
+    """Bring an IncidentIndex up to date with the console. Incidents are
+    parsed one at a time from the response stream, so memory doesn't grow
+    with the size of a page.
+
+    With a cursor from the previous sync only incidents created or changed
+    since then are fetched (incidents/all?incidents_since=...), so an idle
+    poll is one small request: new ones are added, acknowledged ones
+    dropped. Without one, after a console change, or FULL_SYNC_INTERVAL
+    after the last full listing, the full unacknowledged list is fetched
+    instead and replaces the index.
+
+    Returns the new index. Errors from stream propagate, the index passed in
+    then still describes the console.
+    """
+    now = time.time()
+    full_synced = index.full_synced
+    if index.cursor is not None and index.cursor[0] == console_hash and now - full_synced < FULL_SYNC_INTERVAL:
+        keys, alerts = set(index.keys), dict(index.alerts)
+        pages = fetch_pages(stream, "incidents/all", incidents_since = index.cursor[1])
+        updated_id = index.cursor[1]
+    else:
+        logger.info("Fetching all unacknowledged incidents")
+        keys, alerts = set(), {}
+        pages = fetch_pages(stream, "incidents/unacknowledged")
+        updated_id = 0
+        full_synced = now
+
+    changes = 0
+    for page in pages:
+        for incident in page.items:
+            changes += 1
+            updated_id = max(updated_id, int(incident.get("updated_id") or 0))
+            # Keyed by hash, the only id webhooks give us
+            key = incident_key(incident["hash_id"])
+            if is_acknowledged(incident):
+                keys.discard(key)
+                alerts.pop(key, None)
+            elif key in alerts:
+                alerts[key] = alert_from_incident(incident) # Keeps its place
+            elif key not in keys:
+                keys.add(key)
+                alerts[key] = alert_from_incident(incident)
+                if len(alerts) > MAX_ALERTS:
+                    del alerts[next(iter(alerts))]
+            # else: a change to an older incident without an alert, already counted
+        updated_id = max(updated_id, int(page.meta.get("max_updated_id") or 0))
+
+    if not changes and full_synced == index.full_synced and index.cursor == (console_hash, updated_id):
+        return index # Shared, so the next diff() is free
+    if changes:
+        logger.info(f"Incident sync: {changes} new/changed, {len(keys)} unacknowledged, cursor {updated_id}")
+    if len(alerts) < min(MAX_ALERTS, len(keys)) // 2:
+        # Acknowledgements emptied the alerts and only a full fetch can refill them
+        logger.info("Incident alerts ran low, fetching all unacknowledged incidents next time")
+        updated_id = 0
+    # Without an updated_id the next incremental fetch would be the whole history
+    return IncidentIndex(keys, alerts, (console_hash, updated_id) if updated_id else None, full_synced)
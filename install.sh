@@ -13,3 +13,6 @@ sudo systemctl enable --now wificonfig.service
 cd /opt/cg && python3 -m venv venv
 sudo setcap CAP_NET_ADMIN=+eip "$(readlink -f venv/bin/python)" # Persists, The file capability sets are stored in an extended attribute (see setxattr(2)) named security.capability.
 cd /opt/cg && source venv/bin/activate && pip install pillow numpy lgpio spidev gpiozero flask python-dotenv qrcode nmcli canarytools scapy netfilterqueue
+
+# Precompile the animations to memory-mappable RGB565 files (sizes used by main.py)
+cd /opt/cg && source venv/bin/activate && python animation.py 190x190 media/gifs/meander_laser.gif media/gifs/meander_pulse.gif media/gifs/sad.gif media/gifs/alert_incident.gif && python animation.py 160x160 media/gifs/freakout.gif && python animation.py 240x240 pet_animation.gif feed_animation.gif
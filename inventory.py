@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+import logging
+from dataclasses import dataclass
+from incidents import fetch_pages
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 100 # Devices per console API request
+
+# DeviceChange.change values
+ADDED = "added"
+REMOVED = "removed"
+WENT_DOWN = "went down"
+CAME_UP = "came up"
+DISARMED = "disarmed" # last service turned off
+ARMED = "armed" # services enabled on a bare device
+
+@dataclass
+class DeviceChange:
+    device_id: str
+    name: str
+    change: str
+    live: bool
+
+def is_live(device) -> bool:
+    # The console sends "True"/"False" strings
+    return str(device.get("device_live", False)).lower() == "true"
+
+def device_state(device) -> int:
+    """A device's index entry: service count << 1 | live. Small ints are
+    shared by Python, so the index costs little more than its keys"""
+    return int(device.get("service_count") or 0) << 1 | is_live(device)
+
+def scan(stream, index):
+    """Page through every device once, counting live, dead and bare ones and
+    comparing each with its entry in the previous scan's index.
+
+    index maps device id -> device_state(), None before the first scan (no
+    changes are reported then, every device would be new). Returns
+    (counts, new index, [DeviceChange]); errors from stream propagate.
+    """
+    counts = {"live_devices": 0, "dead_devices": 0, "bare_devices": 0}
+    new_index = {}
+    changes = []
+    for page in fetch_pages(stream, "devices/all", "devices", PAGE_SIZE):
+        for device in page.items:
+            device_id = device["id"]
+            state = new_index[device_id] = device_state(device)
+            live, services = state & 1, state >> 1
+            counts["live_devices" if live else "dead_devices"] += 1
+            if services == 0:
+                counts["bare_devices"] += 1
+            if index is None:
+                continue
+            change = lambda what: changes.append(DeviceChange(device_id, device.get("name", device_id), what, bool(live)))
+            old = index.get(device_id)
+            if old is None:
+                change(ADDED)
+                continue
+            if live != old & 1:
+                change(CAME_UP if live else WENT_DOWN)
+            if (services == 0) != (old >> 1 == 0):
+                change(DISARMED if services == 0 else ARMED)
+    if index is not None:
+        changes += [DeviceChange(device_id, device_id, REMOVED, bool(state & 1))
+                    for device_id, state in index.items() if device_id not in new_index]
+    for c in changes:
+        logger.info(f"Device {c.name} {c.change}")
+    return counts, new_index, changes
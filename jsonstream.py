@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import json
+import codecs
+
+_decoder = json.JSONDecoder()
+_WS = ' \t\n\r'
+_END = _WS + ',]}' # what may follow a number
+
+class StreamedObject:
+    """A JSON object read from a stream of byte chunks, with one array member
+    streamed element by element instead of decoded in one go.
+
+        page = StreamedObject(res.iter_content(16384), 'incidents')
+        for incident in page.items:
+            ...
+        page.meta['cursor'] # every other member, complete once items is exhausted
+
+    Only the element being decoded (plus one chunk) is held in memory, so a
+    response with a huge array costs as much as its largest element.
+    """
+
+    def __init__(self, chunks, key):
+        self.key = key
+        self.meta = {}
+        self.count = 0
+        self._chunks = iter(chunks)
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self.items = self._parse()
+
+    def _more(self) -> bool:
+        """Append the next chunk to the buffer, dropping what has been parsed"""
+        if self._eof:
+            return False
+        self._buf = self._buf[self._pos:]
+        self._pos = 0
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._eof = True
+            self._buf += self._text.decode(b'', final = True)
+        else:
+            self._buf += self._text.decode(chunk)
+        return True
+
+    def _peek(self) -> str:
+        """Next non-whitespace character, '' at the end of the stream"""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WS:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._more():
+                return ''
+
+    def _expect(self, chars) -> str:
+        c = self._peek()
+        if c == '' or c not in chars:
+            raise ValueError(f"Expected one of {chars!r} at offset {self._pos}, got {c!r}")
+        self._pos += 1
+        return c
+
+    def _value(self):
+        """Decode the next complete JSON value"""
+        self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+                # A number is only complete once something that can't continue it
+                # follows: 1. or 2e of 1.5 or 2e3 still decode, as 1 and 2
+                if (self._eof or not isinstance(value, (int, float)) or isinstance(value, bool)
+                        or (end < len(self._buf) and self._buf[end] in _END)):
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._more()
+
+    def _parse(self):
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            name = self._value()
+            self._expect(':')
+            if name == self.key and self._peek() == '[':
+                self._pos += 1
+                if self._peek() == ']':
+                    self._pos += 1
+                else:
+                    while True:
+                        item = self._value()
+                        self.count += 1
+                        yield item
+                        if self._expect(',]') == ']':
+                            break
+            else:
+                self.meta[name] = self._value()
+            if self._expect(',}') == '}':
+                return
+
+    def drain(self):
+        """Skip any items not consumed yet, so meta is complete"""
+        for _ in self.items:
+            pass
+        return self.meta
+
+if __name__ == '__main__':
+    # Self-check: every document decodes the same however its bytes are split
+    for doc in ['{"incidents":[1.5e3,-2,10,0.25E-2,true,null,"éx",{"a":[1,2.5]}],"cursor":12.5,"n":-3}',
+                '{"incidents":[123456789, 1e10 ,-0.0],"max_updated_id":987654}',
+                '{ "incidents" : [ ] , "cursor" : null }', '{"a":1}', '{}']:
+        expected = json.loads(doc)
+        items = expected.pop('incidents', [])
+        data = doc.encode()
+        splits = [[data[:i], data[i:j], data[j:]] for i in range(len(data)) for j in range(i, len(data))]
+        for chunks in splits + [[data[i:i + 1] for i in range(len(data))]]:
+            page = StreamedObject(chunks, 'incidents')
+            assert list(page.items) == items and page.meta == expected, chunks
+    page = StreamedObject([b'{"incidents":[1.', b'5e', b'3]}'], 'incidents')
+    assert list(page.items) == [1500.0]
+    print('ok')
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+from PIL import Image
+from textcache import draw_text, text_bbox
+
+class ListView:
+    """A selectable list of text rows that only re-sends what changed.
+
+    Only the rows that fit on screen are drawn. Moving the selection inside
+    the visible page pushes just the two rows whose highlight changed;
+    scrolling past the edge of the page redraws the page once.
+    """
+
+    def __init__(self, display, x = 10, y = 10, row_height = 30, font_size = 20, fill = "WHITE", highlight = (0, 255, 0)):
+        self.display = display
+        self.x = x
+        self.y = y
+        self.row_height = row_height
+        self.font_size = font_size
+        self.fill = fill
+        self.highlight = highlight
+        self.rows_per_page = (display.height - y) // row_height
+        self.items = []
+        self.top = 0
+        self.selected = None # None means the panel does not show this list right now
+
+    def invalidate(self):
+        """Forget what is on the panel, e.g. after another screen was shown"""
+        self.selected = None
+
+    def set_items(self, items):
+        items = list(items)
+        if items != self.items:
+            self.items = items
+            self.invalidate()
+
+    def _row_image(self, i):
+        row = Image.new("RGB", (self.display.width, self.row_height), "BLACK")
+        fill = self.highlight if i == self.selected else self.fill
+        draw_text(row, (self.x, 0), self.items[i], fill = fill, font_size = self.font_size)
+        return row
+
+    def _show_row(self, i):
+        row = self._row_image(i)
+        # Only the text changes colour, so only its bounding box needs sending
+        bbox = text_bbox((self.x, 0), self.items[i], font_size = self.font_size)
+        left, top = max(bbox[0], 0), max(bbox[1], 0)
+        right, bottom = min(bbox[2], row.width), min(bbox[3], row.height)
+        if right > left and bottom > top:
+            self.display.ShowRegion(row.crop((left, top, right, bottom)), left, self.y + (i - self.top) * self.row_height + top)
+
+    def _show_page(self):
+        page = Image.new("RGB", (self.display.width, self.display.height), "BLACK")
+        for i in range(self.top, min(self.top + self.rows_per_page, len(self.items))):
+            page.paste(self._row_image(i), (0, self.y + (i - self.top) * self.row_height))
+        self.display.ShowOnBlack(page)
+
+    def show(self, selected):
+        """Highlight item `selected`, scrolling it into view if needed"""
+        if not self.items:
+            return
+        selected = selected % len(self.items)
+        previous, self.selected = self.selected, selected
+        top = self.top
+        if selected < top:
+            top = selected
+        elif selected >= top + self.rows_per_page:
+            top = selected - self.rows_per_page + 1
+        if previous is None or top != self.top:
+            self.top = top
+            self._show_page()
+        elif previous != selected:
+            self._show_row(previous)
+            self._show_row(selected)
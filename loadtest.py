@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Benchmark canarystate's console polling against a local mock console.
+
+    python loadtest.py --devices 5000 --incidents 20000 --polls 3
+    python loadtest.py --steady 300 --new-incidents 2 --latency 0.05
+
+The first mode runs back-to-back polls with every endpoint due (the first
+one without an incident cursor, i.e. a fresh install). --steady runs the poll_api loop on the real PollScheduler
+for that many seconds while the mock console creates incidents, and reports
+request volume and how long new incidents took to show up.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import resource
+import tempfile
+import threading
+import tracemalloc
+from mockconsole import MockConsole
+
+def total_requests(mock):
+    return sum(mock.requests.values())
+
+def poll_stats(mock, poll):
+    """Run poll(), return (result, seconds, requests, bytes, peak traced memory)"""
+    requests_before, bytes_before = total_requests(mock), mock.bytes_sent
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = poll()
+    elapsed = time.perf_counter() - start
+    return result, elapsed, total_requests(mock) - requests_before, mock.bytes_sent - bytes_before, tracemalloc.get_traced_memory()[1]
+
+def cold_polls(canarystate, mock, polls):
+    state = canarystate.console_state
+    for n in range(polls):
+        for e in canarystate.poll_schedule.endpoints.values():
+            e.next_due = 0
+        state, elapsed, reqs, nbytes, peak = poll_stats(mock, lambda: canarystate.get_console_state(state))
+        label = 'first poll' if n == 0 else f'poll {n + 1}'
+        print(f"{label:>10}: {elapsed * 1000:8.1f} ms  {reqs:6d} requests  {nbytes / 1024:8.1f} KiB  peak {peak / 1024 / 1024:6.1f} MiB  "
+              f"{len(state['unacked'])} unacked ({len(state['unacked'].alerts)} kept), {state['live_devices']} live devices")
+
+def steady(canarystate, mock, duration, new_per_minute):
+    created = {} # hash -> time.monotonic() the mock console created it
+    detected = []
+    stop = threading.Event()
+
+    def churn():
+        while new_per_minute and not stop.wait(random.expovariate(new_per_minute / 60)):
+            incident = mock.add_incident()
+            created[incident['hash_id']] = time.monotonic()
+    threading.Thread(target = churn, daemon = True).start()
+
+    state = canarystate.console_state
+    requests_before = total_requests(mock)
+    wall = []
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        state, elapsed, reqs, nbytes, peak = poll_stats(mock, lambda: canarystate.get_console_state(state))
+        wall.append(elapsed)
+        now = time.monotonic()
+        for alert in state['unacked'].alerts.values():
+            if alert['hash'] in created:
+                detected.append(now - created.pop(alert['hash']))
+        canarystate.poll_schedule.wait(max(end - time.monotonic(), 0))
+    stop.set()
+
+    reqs = total_requests(mock) - requests_before
+    print(f"{len(wall)} polls in {duration}s: {reqs} requests ({reqs / duration * 60:.1f}/min), "
+          f"poll wall time avg {sum(wall) / len(wall) * 1000:.1f} ms, max {max(wall) * 1000:.1f} ms")
+    print(f"by endpoint: {dict(mock.requests)}")
+    if detected:
+        detected.sort()
+        print(f"{len(detected)} new incidents detected after median {detected[len(detected) // 2]:.1f}s, max {detected[-1]:.1f}s"
+              f" ({len(created)} still undetected)")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type = int, default = 5000)
+    parser.add_argument('--incidents', type = int, default = 20000)
+    parser.add_argument('--unacked', type = float, default = 0.2)
+    parser.add_argument('--tokens', type = int, default = 1000)
+    parser.add_argument('--latency', type = float, default = 0.0, help = 'seconds the mock adds to every request')
+    parser.add_argument('--errors', type = float, default = 0.0)
+    parser.add_argument('--throttle', type = float, default = 0.0)
+    parser.add_argument('--polls', type = int, default = 3)
+    parser.add_argument('--steady', type = float, default = 0, help = 'run scheduled polling for this many seconds')
+    parser.add_argument('--new-incidents', type = float, default = 1.0, help = 'incidents per minute created during --steady')
+    args = parser.parse_args()
+
+    setup = time.perf_counter()
+    mock = MockConsole(args.devices, args.incidents, args.unacked, args.tokens, args.latency,
+                       error_rate = args.errors, throttle_rate = args.throttle)
+    url = mock.start()
+    print(f"Mock console with {args.devices} devices, {args.incidents} incidents on {url} ({time.perf_counter() - setup:.1f}s to build)")
+
+    # canarystate reads these on import and keeps its state file in the working directory
+    os.environ.update(CONSOLE_HASH = 'loadtest', API_KEY = mock.auth_token, CONSOLE_URL = url)
+    os.chdir(tempfile.mkdtemp(prefix = 'cg-loadtest-'))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    tracemalloc.start()
+    import canarystate
+
+    if args.steady:
+        steady(canarystate, mock, args.steady, args.new_incidents)
+    else:
+        cold_polls(canarystate, mock, args.polls)
+    print(f"max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+    mock.stop()
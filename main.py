@@ -1,21 +1,30 @@
 #!/usr/bin/env python3
 
 import spidev as SPI
-import logging, qrcode
+import logging
 import ST7789, wifi_config
 from dotenv import load_dotenv
 import time
 import threading
 import requests
 import os
-from PIL import Image, ImageSequence, ImageDraw
+from PIL import Image
 import canarystate
+from listview import ListView
+from animation import AnimationCache, Compositor, FrameScheduler
+from pixelformat import rgb565
+from textcache import draw_text
+from qrcache import QRCache
+from runtime import RenderLoop
+from buttons import ButtonInput
+from webhook import WebhookServer
+from incidents import incident_key
+import inventory
 from canarystate import save_state, canarygotchi_state, console_state, console
 from psd import PSD, PSDEvent
 import queue
 import canarytools
-from copy import deepcopy
-import gpiozero
+from collections import OrderedDict
 import random
 from datetime import datetime, timedelta
 import uuid
@@ -31,6 +40,11 @@ disp = ST7789.ST7789()
 disp.Init()
 disp.clear()
 disp.bl_DutyCycle(50)
+disp.partial_update = True # HUD and borders rarely change, only push dirty tiles
+disp.start_writer() # Animations hand frames to the writer thread via SubmitImage/SubmitFrame
+animation_cache = AnimationCache() # Decoded RGB565 frames, so switching animations doesn't re-decode
+qr_cache = QRCache() # Alert QR codes are pre-rendered by poll_api as incidents arrive
+render_loop = RenderLoop() # Owns the screen; buttons and the poller post work to it
 
 
 # Global variables
@@ -39,10 +53,11 @@ bright_green = (0, 255, 0)
 last_portscan_src = ""
 ENV_FILE = '/opt/cg/.env'
 current_screen = "home"  # Default screen is home
-polling_interval = 20  # Polling interval in seconds
 selected_menu_index = 0
-animation_running = False
-animation_thread = None
+console_state_lock = threading.Lock()  # Polls and webhooks both update console_state
+webhook_alerts = {}  # hash -> (alert, time.monotonic()) pushed by webhook, not yet seen by a poll
+WEBHOOK_GRACE = 120  # Seconds a webhook alert is kept while polls don't list it yet
+portscan_expire = timedelta(seconds=20)  # How long a detected portscan stays on the home screen
 base_animation = "media/gifs/meander_laser.gif"
 base_animation_2 = "media/gifs/meander_pulse.gif"
 sad_animation = "media/gifs/sad.gif"
@@ -52,6 +67,7 @@ pet_animation = "pet_animation.gif"
 feed_animation = "feed_animation.gif"
 current_animation = base_animation
 unacked_incidents = 0
+incident_arrivals = 0  # New incidents seen since start, the home screen reacts when this grows
 cg_uuid = ""
 reg_seq = []
 
@@ -65,6 +81,8 @@ KEY1_PIN       = 21
 KEY2_PIN       = 20
 KEY3_PIN       = 16
 
+BUTTON_DEBOUNCE = 0.03 # Seconds; repeat presses of one key closer than this are contact bounce
+
 # Screen Manager
 class ScreenManager:
     def __init__(self, display):
@@ -81,50 +99,69 @@ class ScreenManager:
             "registration": self.registration_screen,
             "alert_qrcode": self.alert_qrcode_screen
         }
+        self.last_screen = None
+        self.alert_list = ListView(display, font_size=self.font_size, row_height=self.text_y_space, highlight=bright_green)
+        self.icons = {}
+        for name in ("alert", "attack", "sad"):
+            self.icons[name] = Image.open(f"media/icons/{name}.png").convert("RGBA").resize((30, 30))
+        self.home_layers = Compositor(display.width, display.height)
+        self.render_cache = OrderedDict()  # (screen, state key) -> finished RGB565 frame
+        self.render_cache_size = 16
+        self.on_panel = None  # render_cache key of the frame the panel shows, if any
 
     def show_screen(self, screen_name):
-        global animation_running, animation_thread
+        '''Switch screens; runs on the render thread, any running animation is cancelled first'''
         if screen_name in self.screens:
             logging.info(f"Switching to screen: {screen_name}")
-            if animation_running:
-                animation_running = False  # Stop any ongoing animations when switching screens
-                if animation_thread is not None:
-                    animation_thread.join()  # Ensure the animation thread has stopped
-            self.screens[screen_name]()
+            render_loop.start_task(lambda: self._enter_screen(screen_name))
         else:
             logging.error(f"Unknown screen: {screen_name}")
 
+    def _enter_screen(self, screen_name):
+        if screen_name != self.last_screen:
+            self.alert_list.invalidate()  # Panel no longer shows the list
+            self.on_panel = None
+        self.last_screen = screen_name
+        self.screens[screen_name]()
+
+    def show_cached(self, screen_name, key, render):
+        '''Show the image render() draws for a screen whose content depends only on key.
+        The RGB565 frame is reused while key is unchanged, and not pushed again
+        if the panel is already showing it'''
+        cache_key = (screen_name, key)
+        pix = self.render_cache.get(cache_key)
+        if pix is None:
+            pix = rgb565(render())
+            self.render_cache[cache_key] = pix
+            if len(self.render_cache) > self.render_cache_size:
+                self.render_cache.popitem(last=False)
+        else:
+            self.render_cache.move_to_end(cache_key)
+        if self.on_panel == cache_key:
+            return
+        disp.ShowFrame(pix)
+        self.on_panel = cache_key
+
     def home_screen(self):
-        # Display the Tamagotchi animations in a separate thread
+        # Display the Tamagotchi animations until another screen is shown
         def play_animation():
-            global last_portscan_src, incident_animation, attack_animation, sad_animation, animation_running, current_animation, console_state, base_animation, base_animation_2
-
-            animation_running = True
-
-            icon_attack = Image.open("media/icons/attack.png").convert("RGBA")  # Load the icon image
-            icon_attack = icon_attack.resize((30, 30))  # Resize the icon if
-
-            icon_alert = Image.open("media/icons/alert.png").convert("RGBA")  # Load the icon image
-            icon_alert = icon_alert.resize((30, 30))  # Resize the icon if needed
-
-            icon_sad = Image.open("media/icons/sad.png").convert("RGBA")  # Load the icon image
-            icon_sad = icon_sad.resize((30, 30))  # Resize the icon if needed
+            global last_portscan_src, incident_animation, attack_animation, sad_animation, current_animation, console_state, base_animation, base_animation_2
 
             try:
-                gif = Image.open(current_animation)
                 resized_width = disp.width - 50
                 resized_height = disp.height - 50
-                frames = [frame.resize((resized_height, resized_width)).rotate(0) for frame in ImageSequence.Iterator(gif)]
+                anim = animation_cache.get(current_animation, (resized_height, resized_width))
+                scheduler = FrameScheduler(sleep=render_loop.sleep)
                 base_animation_repeats = 0
 
-                last_incident_count = len(console_state['unacked_incidents'])
+                last_incident_count = incident_arrivals
 
                 last_attack_count = len(console_state['attacks'])
                 playAttackAnimation = False
-                while current_screen == "home" and animation_running:
+                while True:
                     playIncidentAnimation = False
                     playAttackAnimation = False
-                    current_incident_count = len(console_state['unacked_incidents'])
+                    current_incident_count = incident_arrivals
                     current_attack_count = len(console_state['attacks'])
                     print("Attack count")
                     print(current_attack_count)
@@ -145,7 +182,7 @@ class ScreenManager:
                         last_portscan_src = console_state['attacks'][last_attack_index].src_ip
                         print("PLAY ATTACK ANIMATION")
                     #else:
-                    #    last_incident_count = len(console_state['unacked_incidents'])
+                    #    last_incident_count = incident_arrivals
 
                     base_animation_repeats += 1
 
@@ -185,136 +222,108 @@ class ScreenManager:
                         elif playIncidentAnimation:
                             current_animation = incident_animation
                         #print(current_animation)
-                        gif = Image.open(current_animation)
-
-
-
+                        anim = animation_cache.get(current_animation, (resized_height, resized_width))
 
-                        frames = [frame.resize((resized_height, resized_width)).rotate(0) for frame in ImageSequence.Iterator(gif)]
+                    for i in scheduler.play(anim.durations[1:]):
+                        frame = anim.frames[i + 1]
 
-                    for frame in frames[1:]:
-                        if not animation_running:
-                            return
+                        # HUD only changes with the counters, the portscan source and the sad icon
+                        hud_key = (unacked_count(), len(console_state['attacks']),
+                                   last_portscan_src, canarygotchi_state["happiness"] < 61)
+                        self.home_layers.set_background(hud_key, self.render_home_hud)
 
+                        # Paste the resized frame below the text and icon
+                        gif_x = (disp.width - resized_width) // 2  # Center horizontally
+                        gif_y = 50
+                        #gif_y = 50  # Leave space for the text and icon
+                        disp.SubmitFrame(self.home_layers.compose(frame, gif_x, gif_y))
+                        if incident_arrivals > last_incident_count or len(console_state['attacks']) > last_attack_count:
+                            break  # React to a new incident/attack now instead of after this loop
+            except KeyboardInterrupt:
+                disp.clear()
+                logging.info("Exited Home Screen")
 
-                        canvas = Image.new("RGB", (disp.width, disp.height), "BLACK")
-                        draw = ImageDraw.Draw(canvas)
-
-
-                        if len(console_state['unacked_incidents']) > 0:
-                            icon_alert_text = str(len(console_state['unacked_incidents']))
-                            icon_alert_x = 5  # Left margin for the icon
-                            icon_alert_y = 5  # Top margin for the icon
-                            icon_alert_text_x = icon_alert_x + icon_alert.width + 5  # Position text to the right of the icon
-                            icon_alert_text_y = icon_alert_y + (icon_alert.height // 2) - 12  # Vertically align text with the icon
-
-
-                            draw.text((icon_alert_text_x, icon_alert_text_y), icon_alert_text, fill="WHITE", font_size=20)
-                            canvas.paste(icon_alert, (icon_alert_x, icon_alert_y), icon_alert)  # Use the alpha channel for transparency
-
-                        # FIX when we have counts for attacks (portscan against Canarygotchi)
-                        # if len(console_state['attacks']) > 0:
-                        #
-                        if len(console_state['attacks']) > 0:
-                            icon_attack_text = str(len(console_state['attacks']))
-                            icon_attack_x = 140  # Left margin for the icon
-                            icon_attack_y = 5  # Top margin for the icon
-                            icon_attack_text_x = icon_attack_x + icon_attack.width + 5  # Position text to the right of the icon
-                            icon_attack_text_y = icon_attack_y + (icon_attack.height // 2) - 12  # Vertically align text with the icon
+        play_animation()
 
-                            draw.text((icon_attack_text_x, icon_attack_text_y), icon_attack_text, fill="WHITE", font_size=20)
+    def render_home_hud(self):
+        '''Home screen layer under the animation: incident/attack counters and mood icons'''
+        canvas = Image.new("RGB", (disp.width, disp.height), "BLACK")
+        icon_alert, icon_attack, icon_sad = self.icons["alert"], self.icons["attack"], self.icons["sad"]
 
-                            draw.text((50,210), f'Portscan {last_portscan_src}', fill="WHITE", font_size=20)
-                            canvas.paste(icon_attack, (icon_attack_x, icon_attack_y), icon_attack)  # Use the alpha channel for transparency
+        if unacked_count() > 0:
+            icon_alert_text = str(unacked_count())
+            icon_alert_x = 5  # Left margin for the icon
+            icon_alert_y = 5  # Top margin for the icon
+            icon_alert_text_x = icon_alert_x + icon_alert.width + 5  # Position text to the right of the icon
+            icon_alert_text_y = icon_alert_y + (icon_alert.height // 2) - 12  # Vertically align text with the icon
 
-                        if canarygotchi_state["happiness"] < 61:
+            draw_text(canvas, (icon_alert_text_x, icon_alert_text_y), icon_alert_text, fill="WHITE", font_size=20)
+            canvas.paste(icon_alert, (icon_alert_x, icon_alert_y), icon_alert)  # Use the alpha channel for transparency
 
-                            icon_sad_x = 205  # Left margin for the icon
-                            icon_sad_y = 5  # Top margin for the icon
+        if len(console_state['attacks']) > 0:
+            icon_attack_text = str(len(console_state['attacks']))
+            icon_attack_x = 140  # Left margin for the icon
+            icon_attack_y = 5  # Top margin for the icon
+            icon_attack_text_x = icon_attack_x + icon_attack.width + 5  # Position text to the right of the icon
+            icon_attack_text_y = icon_attack_y + (icon_attack.height // 2) - 12  # Vertically align text with the icon
 
-                            canvas.paste(icon_sad, (icon_sad_x, icon_sad_y), icon_sad)  # Use the alpha channel for transparency
+            draw_text(canvas, (icon_attack_text_x, icon_attack_text_y), icon_attack_text, fill="WHITE", font_size=20)
 
-                        # Paste the resized frame below the text and icon
-                        gif_x = (disp.width - resized_width) // 2  # Center horizontally
-                        gif_y = 50
-                        #gif_y = 50  # Leave space for the text and icon
-                        canvas.paste(frame, (gif_x, gif_y))
+            draw_text(canvas, (50,210), f'Portscan {last_portscan_src}', fill="WHITE", font_size=20)
+            canvas.paste(icon_attack, (icon_attack_x, icon_attack_y), icon_attack)  # Use the alpha channel for transparency
 
-                        disp.ShowImage(canvas)
-                        time.sleep(0.05)
-                        if current_screen != "home":
-                            return
-            except KeyboardInterrupt:
-                disp.clear()
-                logging.info("Exited Home Screen")
+        if canarygotchi_state["happiness"] < 61:
+            icon_sad_x = 205  # Left margin for the icon
+            icon_sad_y = 5  # Top margin for the icon
 
-        global animation_thread
-        animation_thread = threading.Thread(target=play_animation, daemon=True)
-        animation_thread.start()
+            canvas.paste(icon_sad, (icon_sad_x, icon_sad_y), icon_sad)  # Use the alpha channel for transparency
+        return canvas
 
     def interact_screen(self):
         '''Screen that lets you play with/feed the bird'''
         image = Image.new("RGB", (disp.width, disp.height), "BLACK")
-        draw = ImageDraw.Draw(image)
-        draw.text((10, 10), f"Food: {canarygotchi_state['food_available']}" , fill="WHITE", font_size=self.font_size)
-        draw.text((10, 10+self.text_y_space), f"1: Pet 2: Feed 3: Back" , fill="WHITE", font_size=self.font_size)
-        disp.ShowImage(image)
-
-        def play_interact_animation():
-            global animation_running, current_animation
-            #animation_running = True
-            try:
-                while not animation_running:
-                    pass
-            except KeyboardInterrupt:
-                disp.clear()
-            gif = Image.open(current_animation)
-            if current_animation == feed_animation and canarygotchi_state['food_available'] < 1:
-                image = Image.new("RGB", (disp.width, disp.height), "BLACK")
-                draw = ImageDraw.Draw(image)
-                draw.text((10, 10), f"No food available!" , fill="RED", font_size=self.font_size)
-                draw.text((10, 10+self.text_y_space), f"Deploy a Canarytoken" , fill="WHITE", font_size=self.font_size)
-                disp.ShowImage(image)
-                return
-            if current_animation == feed_animation:
-                canarygotchi_state['food_available'] -= 1
-                canarygotchi_state['hunger'] = 0
-                canarygotchi_state['happiness'] += 10
-            elif current_animation == pet_animation:
-                canarygotchi_state['happiness'] += 10
-            canarystate.save_state(canarygotchi_state, console_state)
-            try:
-                while current_screen == "interact" and animation_running:
-                    for frame in ImageSequence.Iterator(gif):
-                        if not animation_running:
-                            return
-                        frame = frame.resize((disp.width, disp.height))
-                        frame = frame.rotate(0)
-                        disp.ShowImage(frame)
-                        time.sleep(0.05)
-                        if current_screen != "interact":
-                            return
-            except KeyboardInterrupt:
-                disp.clear()
-                logging.info("Exited interact Screen")
-
-        global animation_thread
-        animation_thread = threading.Thread(target=play_interact_animation, daemon=True)
-        animation_thread.start()
+        draw_text(image, (10, 10), f"Food: {canarygotchi_state['food_available']}" , fill="WHITE", font_size=self.font_size)
+        draw_text(image, (10, 10+self.text_y_space), f"1: Pet 2: Feed 3: Back" , fill="WHITE", font_size=self.font_size)
+        disp.ShowOnBlack(image)
+
+    def play_interact_animation(self):
+        '''Pet/feed the bird with current_animation, started by key 1/2 on the interact screen'''
+        if current_animation == feed_animation and canarygotchi_state['food_available'] < 1:
+            image = Image.new("RGB", (disp.width, disp.height), "BLACK")
+            draw_text(image, (10, 10), f"No food available!" , fill="RED", font_size=self.font_size)
+            draw_text(image, (10, 10+self.text_y_space), f"Deploy a Canarytoken" , fill="WHITE", font_size=self.font_size)
+            disp.ShowOnBlack(image)
+            return
+        if current_animation == feed_animation:
+            canarygotchi_state['food_available'] -= 1
+            canarygotchi_state['hunger'] = 0
+            canarygotchi_state['happiness'] += 10
+        elif current_animation == pet_animation:
+            canarygotchi_state['happiness'] += 10
+        canarystate.save_state(canarygotchi_state, console_state)
+        anim = animation_cache.get(current_animation, (disp.width, disp.height))
+        scheduler = FrameScheduler(sleep=render_loop.sleep)
+        shown = None
+        while True:
+            for i in scheduler.play(anim.durations):
+                # Only what changed since the last frame we showed goes over SPI
+                disp.SubmitFrame(anim.frames[i], anim.changed_rect(shown, i))
+                shown = i
 
     def menu_screen(self):
         # Display the menu options
-        image = Image.new("RGB", (disp.width, disp.height), "BLACK")
-        draw = ImageDraw.Draw(image)
-        menu_items = ["1. Stats", "2. Interact", "3. Alerts", "4. WiFI Settings", "5. Console Link"]
-        y = 10
-        for i, item in enumerate(menu_items):
-            if i == selected_menu_index:
-                draw.text((10, y), item, fill=bright_green, font_size=self.font_size)  # Highlight selected item
-            else:
-                draw.text((10, y), item, fill="WHITE", font_size=self.font_size)
-            y += self.text_y_space
-        disp.ShowImage(image)
+        def render():
+            image = Image.new("RGB", (disp.width, disp.height), "BLACK")
+            menu_items = ["1. Stats", "2. Interact", "3. Alerts", "4. WiFI Settings", "5. Console Link"]
+            y = 10
+            for i, item in enumerate(menu_items):
+                if i == selected_menu_index:
+                    draw_text(image, (10, y), item, fill=bright_green, font_size=self.font_size)  # Highlight selected item
+                else:
+                    draw_text(image, (10, y), item, fill="WHITE", font_size=self.font_size)
+                y += self.text_y_space
+            return image
+        self.show_cached("menu", selected_menu_index, render)
 
     def registration_screen(self):
 
@@ -323,13 +332,11 @@ class ScreenManager:
             # Display the menu options
             #image = Image.new("RGB", (disp.width, disp.height), "BLACK")
             #draw = ImageDraw.Draw(image)
-            qrimage = generate_qrcode(f'https://canarygotchi.com/enrollment/?id={cg_uuid}')
-            qrimage = qrimage.resize((200, 200))
+            qrimage = qr_cache.get(f'https://canarygotchi.com/enrollment/?id={cg_uuid}', 200)
             canvas = Image.new("RGB", (disp.width, disp.height), "BLACK")
-            draw = ImageDraw.Draw(canvas)
-            draw.text((5,5), "Enter sequence: ", fill="WHITE", font_size=16)
+            draw_text(canvas, (5,5), "Enter sequence: ", fill="WHITE", font_size=16)
 
-            canvas.paste(qrimage, (20,40), qrimage)
+            canvas.paste(qrimage.convert("RGB"), (20,40))
             disp.ShowImage(canvas)
 
             reg_seq = []
@@ -341,128 +348,79 @@ class ScreenManager:
 
                 if len(reg_seq) == 5:
                     print(reg_seq)
-                    #seq = "sequence=" + ",".join(reg_seq)
-                    seq = {
-                        "sequence": ",".join(reg_seq)
-                    }
-                    print(seq)
-                    r = requests.post(f'http://canarygotchi.com/api/validate-sequence/{cg_uuid}', json=seq)
-
-                    try:
-                        response_data = r.json()
-
-                        print("\nResponse Body:")
-                        print(response_data)
-
-                        # Extract the values for name, hash, and auth_token
-                        name = response_data['data']['name']
-                        hash_value = response_data['data']['hash']
-                        auth_token = response_data['data']['auth_token']
-                        if name != "" and hash_value != "" and auth_token != "":
-                            env_vars = {}
-                            if os.path.exists(ENV_FILE):
-                                with open(ENV_FILE, 'r') as file:
-                                    for line in file.readlines():
-                                        # Strip any whitespace/newlines and split on '=' to get key-value pairs
-                                        if '=' in line:
-                                            key, value = line.strip().split('=', 1)
-                                            env_vars[key] = value
-
-                            # Update or add the required values
-                            env_vars['CONSOLE_HASH'] = hash_value
-                            env_vars['API_KEY'] = auth_token
-                            env_vars['NAME'] = name
-
-                            # Write the updated values back to the .env file
-                            with open(ENV_FILE, 'w') as file:
-                                for key, value in env_vars.items():
-                                    file.write(f"{key}={value}\n")
-
-                    except:
-                        print("Sequence validation failed")
+                    sequence = ",".join(reg_seq)
+                    # Key presses are handled on this thread too, so canarygotchi.com is asked from another one
+                    def validate():
+                        render_loop.post(self.registration_result, validate_sequence(sequence))
+                    threading.Thread(target=validate, daemon=True).start()
                     break
-                time.sleep(0.5)
+                render_loop.sleep(0.5)  # Key presses are appended to reg_seq meanwhile
+
+        play_registration_animation()
 
-        global animation_thread
-        animation_thread = threading.Thread(target=play_registration_animation, daemon=True)
-        animation_thread.start()
+    def registration_result(self, registered):
+        '''Runs on the render loop once canarygotchi.com has answered'''
+        if current_screen != "registration":
+            return
+        status = Image.new("RGB", (disp.width, 35), "BLACK")
+        draw_text(status, (5,5), "Registered!" if registered else "Sequence failed", fill="WHITE", font_size=16)
+        disp.ShowRegion(status, 0, 0)
 
     def stats_screen(self):
         # Display the stats
-        image = Image.new("RGB", (disp.width, disp.height), "BLACK")
-        draw = ImageDraw.Draw(image)
-        draw.text((10, 10), f"Happiness: {canarygotchi_state['happiness']}", fill="WHITE", font_size=self.font_size)
-        draw.text((10, 10+self.text_y_space), f"XP: {canarygotchi_state['xp']}", fill="WHITE", font_size=self.font_size)
-        draw.text((10, 10+self.text_y_space*2), f"Hunger: {canarygotchi_state['hunger']}", fill="WHITE", font_size=self.font_size)
-        draw.text((10, 10+self.text_y_space*3), f"Food available: {canarygotchi_state['food_available']}", fill="WHITE", font_size=self.font_size)
-
-        disp.ShowImage(image)
+        stats = (canarygotchi_state['happiness'], canarygotchi_state['xp'], canarygotchi_state['hunger'], canarygotchi_state['food_available'])
+        def render():
+            image = Image.new("RGB", (disp.width, disp.height), "BLACK")
+            draw_text(image, (10, 10), f"Happiness: {canarygotchi_state['happiness']}", fill="WHITE", font_size=self.font_size)
+            draw_text(image, (10, 10+self.text_y_space), f"XP: {canarygotchi_state['xp']}", fill="WHITE", font_size=self.font_size)
+            draw_text(image, (10, 10+self.text_y_space*2), f"Hunger: {canarygotchi_state['hunger']}", fill="WHITE", font_size=self.font_size)
+            draw_text(image, (10, 10+self.text_y_space*3), f"Food available: {canarygotchi_state['food_available']}", fill="WHITE", font_size=self.font_size)
+            return image
+        self.show_cached("stats", stats, render)
 
     def alerts_screen(self):
         global console_state
         '''Display the alerts'''
-        image = Image.new("RGB", (disp.width, disp.height), "BLACK")
-        draw = ImageDraw.Draw(image)
-        y = 10
-        if len(console_state['unacked_incidents']) > 0:
-            #print(console_state['unacked_incidents'])
-            #for k in console_state['unacked_incidents']:
-            #    print(k.events)
-            #    for s in k.events:
-            #        print(s)
-            #        print(vars(s))
-
-
-            for i, alert in enumerate(console_state['unacked_incidents']):
-
-
-                #repls = { "Canarytoken triggered:": "tkn"}
-
-
-                #for key, value in repls.items():
-                #    title = title.replace(key, value)
-                #print(title)
-
-                if i == selected_menu_index:
-                    draw.text((10, y), f"{i+1}. {alert['title']}", fill=bright_green, font_size=self.font_size)
-                else:
-                    draw.text((10, y), f"{i+1}. {alert['title']}", fill="WHITE", font_size=self.font_size)
-                y += self.text_y_space
+        alerts = shown_alerts()
+        if alerts:
+            self.on_panel = None  # The list view draws straight to the panel
+            self.alert_list.set_items(f"{i+1}. {alert['title']}" for i, alert in enumerate(alerts))
+            self.alert_list.show(selected_menu_index)
         else:
-            draw.text((10, y), "No alerts", fill="WHITE", font_size=self.font_size)
-        disp.ShowImage(image)
+            def render():
+                image = Image.new("RGB", (disp.width, disp.height), "BLACK")
+                draw_text(image, (10, 10), "No alerts", fill="WHITE", font_size=self.font_size)
+                return image
+            self.show_cached("alerts", None, render)
+            self.alert_list.invalidate()
 
     def alert_qrcode_screen(self):
-        alert = console_state['unacked_incidents'][selected_menu_index]
+        alert = shown_alerts()[selected_menu_index]
         logging.info(f"Showing QR for alert: {alert}")
-        image = Image.new("RGB", (disp.width, disp.height), "BLACK")
-        qrimage = generate_qrcode(f'https://{canarystate.console_hash}.canary.tools/nest/incident/{alert["hash"]}')
-        qrimage = qrimage.resize((240, 240))
-        canvas = Image.new("RGB", (disp.width, disp.height), "BLACK")
-        canvas.paste(qrimage, (0,0), qrimage)
-        disp.ShowImage(canvas)
+        disp.ShowImage(qr_cache.get(alert_url(alert), 240).convert("RGB"))
 
     def wifi_screen(self):
         '''Shows WiFi information'''
-        image = Image.new("RGB", (disp.width, disp.height), "BLACK")
-        draw = ImageDraw.Draw(image)
-        y = 10
         ssid = 'canarygotchi'
         cssid = wifi_config.active_ssid()
-        msgs = []
-        if cssid is None or cssid == ssid:
-            # Hotspot
-            msgs.append('Running hotspot:')
-            msgs.append('SSID: ' + ssid)
-            msgs.append('PW: canarygotchi')
-            msgs.append('URL: canarygotchi.local:8080')
-        else:
-            msgs.append('Connected to WiFi')
-            msgs.append(f'SSID: {cssid}')
-        for msg in msgs:
-            draw.text((10, y), msg, fill='WHITE', font_size=self.font_size)
-            y += self.text_y_space
-        disp.ShowImage(image)
+        def render():
+            image = Image.new("RGB", (disp.width, disp.height), "BLACK")
+            y = 10
+            msgs = []
+            if cssid is None or cssid == ssid:
+                # Hotspot
+                msgs.append('Running hotspot:')
+                msgs.append('SSID: ' + ssid)
+                msgs.append('PW: canarygotchi')
+                msgs.append('URL: canarygotchi.local:8080')
+            else:
+                msgs.append('Connected to WiFi')
+                msgs.append(f'SSID: {cssid}')
+            for msg in msgs:
+                draw_text(image, (10, y), msg, fill='WHITE', font_size=self.font_size)
+                y += self.text_y_space
+            return image
+        self.show_cached("wifi", cssid, render)
 
 
 # Button Handling
@@ -470,6 +428,7 @@ class ButtonHandler:
     def __init__(self, display, screen_manager):
         self.display = display
         self.screen_manager = screen_manager
+        self.input = None
 
     def setup_buttons(self):
         button_pins = [
@@ -477,14 +436,19 @@ class ButtonHandler:
             KEY_UP_PIN, KEY_DOWN_PIN, KEY_LEFT_PIN, KEY_RIGHT_PIN
             ]
 
-        buttons = [gpiozero.Button(b) for b in button_pins]
-        for button in buttons:
-            button.when_pressed = self.handle_buttons
-
-    def handle_buttons(self, button):
-        gpio = button.pin.info.name
-        pin_num = int(gpio[4:])
-        global current_screen, selected_menu_index, current_animation, animation_running, reg_seq
+        # Presses are queued from gpiozero's thread and handled on the render loop;
+        # held Up/Down presses collapse into one redraw
+        self.input = ButtonInput(button_pins, self.on_button, render_loop.post,
+                                 coalesce=(KEY_UP_PIN, KEY_DOWN_PIN), debounce=BUTTON_DEBOUNCE)
+        self.display.on_pushed = self.input.pushed
+        self.input.start()
+
+    def on_button(self, pin_num, count=1):
+        '''Handle count presses of one key (more than one for coalesced Up/Down).
+        Returns whether the screen is being redrawn'''
+        global current_screen, selected_menu_index, current_animation, reg_seq
+        # Every redraw, screen switch or animation, starts a render_loop task
+        tasks_started = render_loop.tasks_started
         try:
             if pin_num == KEY1_PIN:  # Key 1 pressed
                 logging.info("Key 1 pressed")
@@ -493,7 +457,7 @@ class ButtonHandler:
                     self.screen_manager.show_screen(current_screen)
                 if current_screen == "interact":
                     current_animation = pet_animation
-                    animation_running = True
+                    render_loop.start_task(self.screen_manager.play_interact_animation)
 
             elif pin_num == KEY2_PIN:  # Key 2 pressed
                 logging.info("Key 2 pressed")
@@ -502,7 +466,7 @@ class ButtonHandler:
                     self.screen_manager.show_screen(current_screen)
                 elif current_screen == "interact":
                     current_animation = feed_animation
-                    animation_running = True
+                    render_loop.start_task(self.screen_manager.play_interact_animation)
 
             elif pin_num == KEY3_PIN:  # Key 3 pressed
                 logging.info("Key 3 pressed")
@@ -516,26 +480,26 @@ class ButtonHandler:
             elif pin_num == KEY_UP_PIN:  # Up button pressed
                 logging.info("Up button pressed")
                 if current_screen == "menu":
-                    selected_menu_index = (selected_menu_index - 1) % 5 # TODO: fix so that menu item count is not hardcoded
+                    selected_menu_index = (selected_menu_index - count) % 5 # TODO: fix so that menu item count is not hardcoded
                     self.screen_manager.show_screen(current_screen)
                 if current_screen == "alerts":
-                    selected_menu_index = (selected_menu_index - 1) % 9 # TODO: fix so that menu item count is not hardcoded
+                    selected_menu_index = (selected_menu_index - count) % max(len(shown_alerts()), 1)
                     self.screen_manager.show_screen(current_screen)
                 if current_screen == "registration":
-                    reg_seq.append("up")
+                    reg_seq.extend(["up"] * count)
                     #self.screen_manager.show_screen(current_screen)
 
 
             elif pin_num == KEY_DOWN_PIN:  # Down button pressed
                 logging.info("Down button pressed")
                 if current_screen == "menu":
-                    selected_menu_index = (selected_menu_index + 1) % 5 # TODO: fix so that menu item count is not hardcoded
+                    selected_menu_index = (selected_menu_index + count) % 5 # TODO: fix so that menu item count is not hardcoded
                     self.screen_manager.show_screen(current_screen)
                 if current_screen == "alerts":
-                    selected_menu_index = (selected_menu_index + 1) % 9 # TODO: fix so that menu item count is not hardcoded
+                    selected_menu_index = (selected_menu_index + count) % max(len(shown_alerts()), 1)
                     self.screen_manager.show_screen(current_screen)
                 if current_screen == "registration":
-                    reg_seq.append("down")
+                    reg_seq.extend(["down"] * count)
                     # self.screen_manager.show_screen(current_screen)
 
             elif pin_num == KEY_LEFT_PIN:  # Left button pressed
@@ -581,54 +545,173 @@ class ButtonHandler:
 
         except KeyboardInterrupt:
             self.display.module_exit()
+        return render_loop.tasks_started != tasks_started
 
 # Background API Polling
 def poll_api():
-    global console_state
     while True:
         try:
             logging.info("Polling console...")
             cs_new = canarystate.get_console_state(console_state)
-
-            new_things = lambda k: cs_new[k] > console_state[k]
-
-            if cs_new['num_deployed_tokens'] > console_state['num_deployed_tokens']:
-                canarygotchi_state['happiness'] += 1
-                canarygotchi_state['xp'] += 5
-                canarygotchi_state['food_available'] += 1
-
-            if new_things('live_devices'):
-                canarygotchi_state['happiness'] += 1
-                canarygotchi_state['xp'] += 5
-
-            if new_things('dead_devices'):
-                canarygotchi_state['happiness'] -= 1
-
-            if len(cs_new['unacked_incidents']) != len(console_state['unacked_incidents']):
-                unacked_difference = len(cs_new['unacked_incidents']) - len(console_state['unacked_incidents'])
-                canarygotchi_state['happiness'] -= unacked_difference
-                logging.info(f"Unack'd delta: {unacked_difference}")
-
-            #response = requests.get(f"{console_hash}/api/v1/ping", params=payload)
-            #if response.status_code == 200:
-                # Trigger event-based animations if needed
-                #if "event_animation" in data:
-                #    global current_animation
-                #    current_animation = "some other animation"
-                #    logging.info(f"Switching to event animation: {current_animation}")
-                #    if current_screen == "home":
-                        # Restart the animation thread to play the new animation
-                #        screen_manager.show_screen(current_screen)
-            logging.warn(f"console_state: {console_state} cs_new: {cs_new}")
-            console_state = deepcopy(console_state | cs_new)
-            canarystate.save_state(canarygotchi_state, console_state)
+            with console_state_lock:
+                apply_console_state(cs_new)
         except canarytools.ConsoleError:
             logging.exception(f"API request failed")
 
-        time.sleep(polling_interval)
+        # Each endpoint has its own interval, see canarystate.poll_schedule
+        canarystate.poll_schedule.wait()
+
+def apply_console_state(cs_new):
+    '''Update the bird from a freshly polled console state and save both'''
+    global console_state, incident_arrivals
+    if cs_new['num_deployed_tokens'] > console_state['num_deployed_tokens']:
+        canarygotchi_state['happiness'] += 1
+        canarygotchi_state['xp'] += 5
+        canarygotchi_state['food_available'] += 1
+
+    # Per device, so one Canary going down while another comes up still counts.
+    # Only a device becoming live or dead scores, as the live/dead totals did
+    for change in cs_new.pop('device_changes', []):
+        if change.change == inventory.CAME_UP or (change.change == inventory.ADDED and change.live):
+            canarygotchi_state['happiness'] += 1
+            canarygotchi_state['xp'] += 5
+        elif change.change == inventory.WENT_DOWN or (change.change == inventory.ADDED and not change.live):
+            canarygotchi_state['happiness'] -= 1
+
+    # Per incident, so one acknowledged while another comes in isn't "no change".
+    # The first sync lists the whole backlog, none of which just arrived
+    if console_state['unacked'].synced:
+        added, removed = cs_new['unacked'].diff(console_state['unacked'])
+    else:
+        added, removed = set(), set()
+
+    # Webhook alerts were scored when they came in. Once a poll lists one it
+    # isn't new any more; one no poll listed within WEBHOOK_GRACE (acknowledged
+    # already, or never a console incident) is taken back. They are only
+    # removed below, once console_state shows the poll that listed them.
+    settled = []
+    for h, (alert, received) in list(webhook_alerts.items()):
+        if h in cs_new['unacked']:
+            added.discard(incident_key(h))
+            settled.append(h)
+        elif time.monotonic() - received > WEBHOOK_GRACE:
+            canarygotchi_state['happiness'] += 1
+            settled.append(h)
+            logging.info(f"Webhook incident not listed by the console, dropping it: {alert['title']}")
+
+    if added or removed:
+        canarygotchi_state['happiness'] += len(removed) - len(added)
+        incident_arrivals += len(added)
+        logging.info(f"Unack'd: {len(added)} new, {len(removed)} acknowledged")
+
+    #response = requests.get(f"{console_hash}/api/v1/ping", params=payload)
+    #if response.status_code == 200:
+        # Trigger event-based animations if needed
+        #if "event_animation" in data:
+        #    global current_animation
+        #    current_animation = "some other animation"
+        #    logging.info(f"Switching to event animation: {current_animation}")
+        #    if current_screen == "home":
+                # Restart the animation thread to play the new animation
+        #        screen_manager.show_screen(current_screen)
+    # Render QR codes for new incidents now so opening one is instant
+    known = console_state['unacked'].alerts
+    qr_cache.prerender([alert_url(a) for k, a in cs_new['unacked'].alerts.items() if k not in known], 240)
+    qr_cache.prune(alert_url(None), [alert_url(a) for a in cs_new['unacked'].alerts.values()] +
+                   [alert_url(a) for h, (a, received) in webhook_alerts.items() if h not in settled])
+
+    # One entry per device, too long to log
+    brief = lambda cs: {k: v for k, v in cs.items() if k != 'device_index'}
+    logging.warn(f"console_state: {brief(console_state)} cs_new: {brief(cs_new)}")
+    logging.debug(f"Display frames: {disp.writer_stats()}")
+    if button_handler.input is not None:
+        logging.info(f"Button input: {button_handler.input.stats()}")
+    console_state = console_state | cs_new
+    for h in settled:
+        del webhook_alerts[h]
+    canarystate.save_state(canarygotchi_state, console_state)
+
+def receive_alert(alert):
+    '''Incident pushed by a console webhook, shown and scored right away. It stays
+    out of console_state['unacked'] until a poll lists it, see apply_console_state()'''
+    global incident_arrivals
+    with console_state_lock:
+        if alert['hash'] in console_state['unacked'] or alert['hash'] in webhook_alerts:
+            return
+        logging.info(f"Webhook incident: {alert['title']}")
+        webhook_alerts[alert['hash']] = (alert, time.monotonic())
+        canarygotchi_state['happiness'] -= 1
+        incident_arrivals += 1
+        qr_cache.prerender([alert_url(alert)], 240)
+        canarystate.save_state(canarygotchi_state, console_state)
+    # Have a poll confirm it well within WEBHOOK_GRACE
+    canarystate.poll_schedule.tighten('incidents')
+    render_loop.post(refresh_alerts)
+
+def shown_alerts() -> list:
+    '''Alert list, newest first: webhook alerts no poll has listed yet, then the console's'''
+    unacked = console_state['unacked']
+    pending = [alert for alert, received in reversed(list(webhook_alerts.values())) if alert['hash'] not in unacked]
+    return pending + unacked.newest()
+
+def unacked_count() -> int:
+    '''Unacknowledged incidents, counting webhook alerts no poll has listed yet'''
+    unacked = console_state['unacked']
+    return len(unacked) + sum(1 for alert, received in list(webhook_alerts.values()) if alert['hash'] not in unacked)
+
+REGISTRATION_TIMEOUT = 10  # Seconds to wait for canarygotchi.com
+
+def validate_sequence(sequence) -> bool:
+    '''Exchange an entered button sequence for console credentials and save them to ENV_FILE'''
+    seq = {
+        "sequence": sequence
+    }
+    print(seq)
+    try:
+        r = requests.post(f'http://canarygotchi.com/api/validate-sequence/{cg_uuid}', json=seq, timeout=REGISTRATION_TIMEOUT)
+        response_data = r.json()
+
+        print("\nResponse Body:")
+        print(response_data)
+
+        # Extract the values for name, hash, and auth_token
+        name = response_data['data']['name']
+        hash_value = response_data['data']['hash']
+        auth_token = response_data['data']['auth_token']
+        if name == "" or hash_value == "" or auth_token == "":
+            return False
+        env_vars = {}
+        if os.path.exists(ENV_FILE):
+            with open(ENV_FILE, 'r') as file:
+                for line in file.readlines():
+                    # Strip any whitespace/newlines and split on '=' to get key-value pairs
+                    if '=' in line:
+                        key, value = line.strip().split('=', 1)
+                        env_vars[key] = value
+
+        # Update or add the required values
+        env_vars['CONSOLE_HASH'] = hash_value
+        env_vars['API_KEY'] = auth_token
+        env_vars['NAME'] = name
+
+        # Write the updated values back to the .env file
+        with open(ENV_FILE, 'w') as file:
+            for key, value in env_vars.items():
+                file.write(f"{key}={value}\n")
+        return True
+    except:
+        print("Sequence validation failed")
+        return False
+
+def refresh_alerts():
+    # The home screen notices new incidents by itself, the alert list has to be redrawn
+    if current_screen == "alerts":
+        screen_manager.show_screen(current_screen)
 
-def generate_qrcode(url : str) -> Image:
-    return qrcode.make(url)
+def alert_url(alert) -> str:
+    """Console link for an incident, or the prefix all incident links share if alert is None"""
+    prefix = f'https://{canarystate.console_hash}.canary.tools/nest/incident/'
+    return prefix if alert is None else prefix + alert['hash']
 
 # Main Function
 def main():
@@ -646,65 +729,58 @@ def main():
             fp.write(efc)
         cg_uuid = str(tmp_uuid)
 
-    # Grabbing first 10 incidents at start, this should be moved to a function as part of the polling/heartbeat
-    # 1. Get unacknowledged incidents, limit 1
-    # 2. if 0 or incident == last incident ID STOP
-    # 3. Else: get incidents - paginated - until we have the same state localy as we do on the console
-    new_alerts = []
-
-    for incident in console.incidents.unacknowledged():
-        # Extract necessary fields
-        incident_summary = incident.summary
-        incident_description = incident.description if incident.description != "" else "No memo available"  # Default if "memo" key doesn't exist
-        incident_id = incident.id
-
-        # Determine the title based on the incident_name
-        # Super limited space on the screen, so we need to shorten stuff
-        if incident_description == "N/A": # incident from canarytoken
-            incident_title = f"Token: {incident_description}" # [:20]
-        else: #incident from Canary
-            incident_title = f"{incident_description}: {incident_summary}" #:20
-
-        # Create the incident dictionary
-        new_alerts.append({
-            "title": incident_title,
-            "id": incident_id
-        })
-    global canarygotchi_state
-    canarygotchi_state['alerts'] = new_alerts
-
-
-    global screen_manager
+    # Unacknowledged incidents come from the saved state and are brought up to
+    # date incrementally by the first poll (see incidents.sync)
+
+    global screen_manager, button_handler
     screen_manager = ScreenManager(disp)
     button_handler = ButtonHandler(disp, screen_manager)
 
-    # Start API polling in a separate thread
-    api_thread = threading.Thread(target=poll_api, daemon=True)
-    api_thread.start()
-
     # Show the home screen initially
-    screen_manager.show_screen(current_screen)
+    render_loop.start()
+    render_loop.post(screen_manager.show_screen, current_screen)
 
     # Start button handling
     button_handler.setup_buttons()
 
+    # Optional push delivery of incidents, polling then only reconciles
+    if os.environ.get('WEBHOOK_PORT') and not os.environ.get('WEBHOOK_TOKEN'):
+        logging.error("WEBHOOK_PORT is set but WEBHOOK_TOKEN isn't, not listening for webhooks")
+    elif os.environ.get('WEBHOOK_PORT'):
+        webhook = WebhookServer(receive_alert, os.environ['WEBHOOK_TOKEN'], port=int(os.environ['WEBHOOK_PORT']))
+        webhook.start()
+        canarystate.poll_schedule.set_interval('incidents', fast=60, slow=300)
+
+    run_threads()
+
+def record_attack(psd_event):
+    console_state['attacks'].append(psd_event)
+    canarystate.poll_schedule.tighten('incidents')  # A scan often comes with new incidents
+    canarystate.save_state(canarygotchi_state, console_state)
+
+def expire_attacks():
+    attacks_after_expiry = [p for p in console_state['attacks'] if p.timestamp > (datetime.now() - portscan_expire)]
+    # attacks_after_expiry has to be <= existing console_state['attacks'] as its a filtered (sub)set thereof.
+    attacks_delta = len(console_state['attacks']) - len(attacks_after_expiry)
+    console_state['attacks'] = attacks_after_expiry
+    logging.warn(f"Attacks: {console_state['attacks']}")
+    if attacks_delta > 0:
+        logging.info(f"Expired {attacks_delta} attacks")
+
+def run_threads():
+    '''API polling thread, PSD thread and the PSD event loop here'''
+    # Start API polling in a separate thread
+    api_thread = threading.Thread(target=poll_api, daemon=True)
+    api_thread.start()
+
     psd_queue = queue.Queue()
     psd = PSD(psd_queue)
     psd.start()
-    portscan_expire = timedelta(seconds=20)
     while True:
         try:
-            psd_event = psd_queue.get(timeout=5)
-            console_state['attacks'].append(psd_event)
-            canarystate.save_state(canarygotchi_state, console_state)
+            record_attack(psd_queue.get(timeout=5))
         except queue.Empty:
-            attacks_after_expiry = [p for p in console_state['attacks'] if p.timestamp > (datetime.now() - portscan_expire)]
-            # attacks_after_expiry has to be <= existing console_state['attacks'] as its a filtered (sub)set thereof.
-            attacks_delta = len(console_state['attacks']) - len(attacks_after_expiry)
-            console_state['attacks'] = attacks_after_expiry
-            logging.warn(f"Attacks: {console_state['attacks']}")
-            if attacks_delta > 0:
-                logging.info(f"Expired {attacks_delta} attacks")
+            expire_attacks()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+class MockConsole:
+    """Local stand-in for a Canary console's API, for load testing canarystate.
+
+    Serves the endpoints canarystate and canarytools use against a generated
+    fleet of `devices` devices, `incidents` incidents (`unacked` of them
+    unacknowledged) and `tokens` Canarytokens. Every request can be delayed
+    by `latency` seconds (+- `jitter`) and fails with a 500 with probability
+    `error_rate` or a 429 with probability `throttle_rate`. Run canarystate
+    against it with CONSOLE_URL=http://127.0.0.1:<port>.
+    """
+
+    def __init__(self, devices = 50, incidents = 200, unacked = 0.2, tokens = 100, latency = 0.0, jitter = 0.0,
+                 error_rate = 0.0, throttle_rate = 0.0, auth_token = 'mock', seed = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.auth_token = auth_token
+        self.requests = Counter() # endpoint -> requests served
+        self.bytes_sent = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self.updated_id = 0
+        self.devices = [self._device(i) for i in range(devices)]
+        self._devices_by_id = {d['id']: d for d in self.devices}
+        self.incidents = {} # hash -> incident, in creation order
+        for i in range(incidents):
+            self.add_incident(acknowledged = self._random.random() >= unacked)
+        self.tokens = [{'canarytoken': f'tok{i:08x}', 'kind': 'http', 'memo': f'Mock token {i}', 'enabled': True}
+                       for i in range(tokens)]
+
+    def _device(self, i):
+        return {
+            'id': f'{i:016x}',
+            'name': f'mock-canary-{i}',
+            'description': 'Mock Canary',
+            'ip_address': f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}',
+            'device_live': 'True' if self._random.random() > 0.05 else 'False',
+            'service_count': self._random.choice([0, 1, 2, 3, 5]),
+        }
+
+    def add_incident(self, acknowledged = False, token = None):
+        """Create an incident the way a triggered Canary/Canarytoken would"""
+        with self._lock:
+            self.updated_id += 1
+            n = len(self.incidents)
+            token = self._random.random() < 0.3 if token is None else token
+            device = self.devices[n % len(self.devices)] if self.devices and not token else None
+            incident = {
+                'id': f'incident:mock:{n}',
+                'hash_id': f'{n:032x}',
+                'summary': 'Canarytoken triggered' if token else self._random.choice(['Port Scan', 'Shared File Opened', 'SSH Login Attempt', 'HTTP Login Attempt']),
+                'description': {'name': 'N/A', 'memo': f'Mock token {n}'} if token else {'name': device['name'] if device else 'mock-canary'},
+                'acknowledged': str(acknowledged),
+                'updated_id': self.updated_id,
+                'created': int(time.time()),
+            }
+            self.incidents[incident['hash_id']] = incident
+            return incident
+
+    def ack_incident(self, incident_hash = None):
+        """Acknowledge one incident (the oldest unacknowledged if not given)"""
+        with self._lock:
+            if incident_hash is None:
+                incident_hash = next((h for h, i in self.incidents.items() if i['acknowledged'] == 'False'), None)
+                if incident_hash is None:
+                    return None
+            incident = self.incidents[incident_hash]
+            self.updated_id += 1
+            incident['acknowledged'] = 'True'
+            incident['updated_id'] = self.updated_id
+            return incident
+
+    def _page(self, items, params, key):
+        """Cursor pagination like the console: limit=N, then cursor=<next>,
+        which carries the page size on like the console's opaque cursors do"""
+        start, limit = map(int, params['cursor'].split(':')) if 'cursor' in params else (0, int(params.get('limit', 0)))
+        limit = limit or len(items)
+        page = {key: items[start:start + limit], 'max_updated_id': self.updated_id}
+        if 'limit' in params or 'cursor' in params:
+            page['cursor'] = {'next': f'{start + limit}:{limit}' if start + limit < len(items) else None, 'prev': None}
+        return page
+
+    def respond(self, endpoint, params):
+        """(status, body) for one API call"""
+        if params.get('auth_token') != self.auth_token:
+            return 403, {'result': 'error', 'message': 'Invalid auth_token'}
+        with self._lock:
+            incidents = self.incidents.values()
+            if endpoint == 'license/detailed/info':
+                return 200, {'result': 'success', 'canaryvm_remaining_licenses': 3, 'devices_total': len(self.devices)}
+            if endpoint == 'canarytokens/fetch':
+                return 200, {'result': 'success', 'tokens': self.tokens}
+            if endpoint == 'incidents/unacknowledged':
+                return 200, self._page([i for i in incidents if i['acknowledged'] == 'False'], params, 'incidents')
+            if endpoint == 'incidents/all':
+                since = int(params.get('incidents_since', 0))
+                changed = sorted((i for i in incidents if i['updated_id'] > since), key = lambda i: i['updated_id'])
+                return 200, self._page(changed, params, 'incidents')
+            if endpoint == 'devices/all':
+                return 200, self._page(self.devices, params, 'devices')
+            if endpoint == 'device/getinfo':
+                device = self._devices_by_id.get(params.get('node_id'))
+                if device is None:
+                    return 404, {'result': 'error', 'message': 'Device not found'}
+                return 200, {'result': 'success', 'device': device}
+        return 404, {'result': 'error', 'message': f'Unknown endpoint {endpoint}'}
+
+    def start(self, port = 0):
+        """Serve on 127.0.0.1:port (0 picks a free one) from a background thread; returns the base URL"""
+        console = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # Keep-alive, like the real console
+            disable_nagle_algorithm = True # Headers and body go out in separate writes
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                # canarystate sends its parameters form-encoded in the body
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    params.update({k: v[-1] for k, v in parse_qs(self.rfile.read(length).decode()).items()})
+                endpoint = url.path.split('/api/v1/', 1)[-1].removesuffix('.json')
+                status, body, headers = console.handle(endpoint, params)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+                with console._lock:
+                    console.bytes_sent += len(data)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target = self._server.serve_forever, name = 'mock-console', daemon = True).start()
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def handle(self, endpoint, params):
+        """Latency and error injection around respond(); (status, body, headers)"""
+        with self._lock:
+            self.requests[endpoint] += 1
+            delay = max(self.latency + self._random.uniform(-self.jitter, self.jitter), 0)
+            roll = self._random.random()
+        if delay:
+            time.sleep(delay)
+        if roll < self.throttle_rate:
+            return 429, {'result': 'error', 'message': 'Too many requests'}, {'Retry-After': '1'}
+        if roll < self.throttle_rate + self.error_rate:
+            return 500, {'result': 'error', 'message': 'Injected error'}, {}
+        status, body = self.respond(endpoint, params)
+        return status, body, {}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Serve a mock Canary console API')
+    parser.add_argument('--port', type = int, default = 8082)
+    parser.add_argument('--devices', type = int, default = 5000)
+    parser.add_argument('--incidents', type = int, default = 20000)
+    parser.add_argument('--unacked', type = float, default = 0.2, help = 'share of incidents left unacknowledged')
+    parser.add_argument('--tokens', type = int, default = 1000)
+    parser.add_argument('--latency', type = float, default = 0.0, help = 'seconds added to every request')
+    parser.add_argument('--jitter', type = float, default = 0.0)
+    parser.add_argument('--errors', type = float, default = 0.0, help = 'share of requests failing with 500')
+    parser.add_argument('--throttle', type = float, default = 0.0, help = 'share of requests failing with 429')
+    parser.add_argument('--auth-token', default = 'mock')
+    args = parser.parse_args()
+    logging.basicConfig(level = logging.INFO)
+    console = MockConsole(args.devices, args.incidents, args.unacked, args.tokens, args.latency, args.jitter,
+                          args.errors, args.throttle, args.auth_token)
+    print(f"Mock console on {console.start(args.port)} (CONSOLE_HASH=anything API_KEY={args.auth_token})")
+    try:
+        while True:
+            time.sleep(60)
+            print(dict(console.requests))
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""Pixel packing shared by the display driver and the offline animation
+compiler. No hardware imports here: animation.py runs on hosts without SPI."""
+
+import numpy as np
+
+def rgb565(Image, pix = None, tmp = None):
+    """Pack an RGB888 PIL image into a (height, width, 2) big-endian RGB565 array.
+
+    pix and tmp ((h, w, 2) and (h, w) uint8) can be passed in to convert
+    without allocating.
+    """
+    if Image.mode != 'RGB':
+        Image = Image.convert('RGB')
+    img = np.asarray(Image)
+    if pix is None:
+        pix = np.empty(img.shape[:2] + (2,), dtype = np.uint8)
+    if tmp is None:
+        tmp = np.empty(img.shape[:2], dtype = np.uint8)
+    hi, lo = pix[...,0], pix[...,1]
+    # hi = RRRRRGGG, lo = GGGBBBBB
+    np.bitwise_and(img[...,0], 0xF8, out = hi)
+    np.right_shift(img[...,1], 5, out = tmp)
+    np.bitwise_or(hi, tmp, out = hi)
+    np.left_shift(img[...,1], 3, out = tmp)
+    np.bitwise_and(tmp, 0xE0, out = lo)
+    np.right_shift(img[...,2], 3, out = tmp)
+    np.bitwise_or(lo, tmp, out = lo)
+    return pix
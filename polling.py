@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import time
+import random
+import logging
+import threading
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Endpoint:
+    """Polling interval bounds (seconds) for one console endpoint.
+
+    After a poll that found changes the interval drops to `fast`, after each
+    quiet one it grows by `relax` up to `slow`.
+    """
+    fast: float
+    slow: float
+    relax: float = 1.5
+    interval: float = None
+    next_due: float = 0.0 # time.monotonic(); 0 polls right away
+    failures: int = 0
+
+    def __post_init__(self):
+        if self.interval is None:
+            self.interval = self.fast
+
+class PollScheduler:
+    """Decides which console endpoints are due for a poll.
+
+    Each endpoint has its own interval: it tightens after a poll that saw
+    changes (or when tighten() is called, e.g. on a portscan) and relaxes
+    while nothing happens. Failed polls back off exponentially with full
+    jitter, or for as long as a 429's Retry-After asks.
+    """
+
+    JITTER = 0.1 # +-10% on regular intervals so endpoints don't stay in lockstep
+    BACKOFF_BASE = 5.0
+    BACKOFF_MAX = 600.0
+
+    def __init__(self, endpoints):
+        self.endpoints = endpoints
+        self._wakeup = threading.Condition()
+
+    def due(self, now = None) -> list[str]:
+        now = time.monotonic() if now is None else now
+        with self._wakeup:
+            return [name for name, e in self.endpoints.items() if e.next_due <= now]
+
+    def wait_time(self, now = None) -> float:
+        """Seconds until the next endpoint is due"""
+        now = time.monotonic() if now is None else now
+        with self._wakeup:
+            return max(min(e.next_due for e in self.endpoints.values()) - now, 0)
+
+    def wait(self, timeout = None):
+        """Sleep until an endpoint is due, tighten() cuts this short"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._wakeup:
+            while (delay := self.wait_time()) > 0:
+                if deadline is not None:
+                    delay = min(delay, deadline - time.monotonic())
+                    if delay <= 0:
+                        return
+                self._wakeup.wait(delay)
+
+    def done(self, name, changed):
+        with self._wakeup:
+            e = self.endpoints[name]
+            e.failures = 0
+            e.interval = e.fast if changed else min(e.interval * e.relax, e.slow)
+            e.next_due = time.monotonic() + e.interval * random.uniform(1 - self.JITTER, 1 + self.JITTER)
+
+    def failed(self, name, retry_after = None):
+        with self._wakeup:
+            e = self.endpoints[name]
+            e.failures += 1
+            delay = random.uniform(0, min(self.BACKOFF_BASE * 2 ** e.failures, self.BACKOFF_MAX))
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            delay = max(delay, e.fast)
+            e.next_due = time.monotonic() + delay
+            logger.warning(f"Polling {name} failed {e.failures}x, retrying in {delay:.0f}s")
+
+    def set_interval(self, name, fast, slow):
+        with self._wakeup:
+            e = self.endpoints[name]
+            e.fast, e.slow = fast, slow
+            e.interval = min(max(e.interval, fast), slow)
+
+    def tighten(self, *names):
+        """Something happened: poll these now and at their fast rate"""
+        with self._wakeup:
+            for name in names:
+                e = self.endpoints[name]
+                if e.failures == 0:
+                    e.interval = e.fast
+                    e.next_due = min(e.next_due, time.monotonic())
+            self._wakeup.notify_all()
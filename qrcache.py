@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import logging
+import threading
+import qrcode
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+def render_qrcode(url : str, size : int):
+    """QR code for url as a size x size 1-bit image (black modules on white)"""
+    return qrcode.make(url).get_image().resize((size, size))
+
+class QRCache:
+    """Rendered QR codes keyed by (url, size), least recently used evicted first.
+
+    Codes for incidents can be rendered ahead of time on a background thread
+    with prerender(), so opening one on the UI thread is just a lookup.
+    """
+
+    def __init__(self, max_entries = 64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url : str, size : int):
+        key = (url, size)
+        with self._lock:
+            image = self._entries.get(key)
+            if image is not None:
+                self._entries.move_to_end(key)
+                return image
+        image = render_qrcode(url, size)
+        with self._lock:
+            self._entries[key] = image
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+        return image
+
+    def prerender(self, urls, size : int):
+        """Render any of urls not cached yet, without blocking the caller"""
+        with self._lock:
+            missing = [u for u in urls if (u, size) not in self._entries]
+        if not missing:
+            return
+        def render_all():
+            for url in missing:
+                try:
+                    self.get(url, size)
+                except Exception:
+                    logger.exception(f"Failed to pre-render QR code for {url}")
+        threading.Thread(target = render_all, daemon = True).start()
+
+    def prune(self, prefix : str, keep):
+        """Drop cached codes whose url starts with prefix but is not in keep,
+        e.g. incidents that have been acknowledged"""
+        keep = set(keep)
+        with self._lock:
+            for key in [k for k in self._entries if k[0].startswith(prefix) and k[0] not in keep]:
+                del self._entries[key]
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class Cancelled(Exception):
+    """Raised inside a task at its next sleep() once it has been replaced"""
+
+class RenderLoop:
+    """One long-lived thread that owns the screen.
+
+    Other threads (button callbacks, the API poller) hand it work with post()
+    and return straight away. At most one task, e.g. an animation, runs at a
+    time; it waits through sleep(), which keeps running posted commands, so
+    the loop stays responsive while it plays. Starting a new task cancels the
+    current one at its next sleep() and runs the new one once it has unwound.
+    """
+
+    def __init__(self):
+        self._commands = queue.SimpleQueue()
+        self._next = None # Task to run once the current one has unwound
+        self._cancelled = False
+        self._thread = None
+        self.tasks_started = 0 # start_task() calls, so a caller can tell whether it started one
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target = self._run, name = 'render', daemon = True)
+            self._thread.start()
+
+    def post(self, fn, *args):
+        """Run fn(*args) on the render thread; callable from any thread, never blocks"""
+        self._commands.put((fn, args))
+
+    def start_task(self, fn):
+        """Replace the running task with fn(), only from the render thread"""
+        self._next = fn
+        self._cancelled = True
+        self.tasks_started += 1
+
+    def sleep(self, seconds):
+        """Wait on the render thread, running posted commands in the meantime.
+        Raises Cancelled if the current task was replaced"""
+        deadline = time.monotonic() + seconds
+        while True:
+            if self._cancelled:
+                raise Cancelled()
+            remaining = deadline - time.monotonic()
+            try:
+                fn, args = self._commands.get(timeout = remaining) if remaining > 0 else self._commands.get_nowait()
+            except queue.Empty:
+                if self._cancelled:
+                    raise Cancelled()
+                return
+            self._execute(fn, args)
+
+    def _execute(self, fn, args):
+        try:
+            fn(*args)
+        except Exception:
+            logger.exception(f"Render command {fn.__name__} failed")
+
+    def _run(self):
+        while True:
+            if self._next is not None:
+                task, self._next = self._next, None
+                self._cancelled = False
+                try:
+                    task()
+                except Cancelled:
+                    pass
+                except Exception:
+                    logger.exception(f"Render task {task.__name__} failed")
+                self._cancelled = False
+                continue
+            fn, args = self._commands.get()
+            self._execute(fn, args)
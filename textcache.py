@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import re
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+from PIL import Image, ImageDraw, ImageFont
+
+MAX_GLYPHS = 512 # Cached text masks, least recently used dropped first
+
+_masks = OrderedDict()
+_lock = Lock()
+
+# Digits are blitted one by one so changing counters reuse ten glyphs
+# instead of filling the cache with every number ever shown
+_pieces = re.compile(r'\d|\D+')
+
+@lru_cache(maxsize=None)
+def get_font(size):
+    """Default font at `size`; draw.text(font_size=...) would load it on every call"""
+    return ImageFont.load_default(size)
+
+def _glyph(text, size):
+    """(mask, advance) for a string, rasterised once"""
+    key = (text, size)
+    with _lock:
+        glyph = _masks.get(key)
+        if glyph is not None:
+            _masks.move_to_end(key)
+            return glyph
+    font = get_font(size)
+    left, top, right, bottom = font.getbbox(text)
+    mask = Image.new("L", (max(right, 1), max(bottom, 1)))
+    ImageDraw.Draw(mask).text((0, 0), text, fill=255, font=font)
+    glyph = (mask, font.getlength(text))
+    with _lock:
+        _masks[key] = glyph
+        if len(_masks) > MAX_GLYPHS:
+            _masks.popitem(last=False)
+    return glyph
+
+def draw_text(image, xy, text, fill="WHITE", font_size=20):
+    """Same result as ImageDraw.Draw(image).text(xy, text, fill=fill, font_size=font_size),
+    but labels and digits are pasted from cached masks instead of re-rasterised"""
+    x, y = xy
+    for piece in _pieces.findall(text):
+        mask, advance = _glyph(piece, font_size)
+        left = round(x)
+        image.paste(fill, (left, y, left + mask.width, y + mask.height), mask)
+        x += advance
+
+def text_bbox(xy, text, font_size=20):
+    """Bounding box of draw_text(xy, text) like ImageDraw.textbbox"""
+    left, top, right, bottom = get_font(font_size).getbbox(text)
+    return (xy[0] + left, xy[1] + top, xy[0] + right, xy[1] + bottom)
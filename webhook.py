@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import logging
+import threading
+import urllib.request
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from incidents import alert_from_incident
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY = 64 * 1024 # Console webhook payloads are a few KB
+
+def incident_from_webhook(payload) -> dict:
+    """The console API incident fields alert_from_incident() needs, from a
+    console webhook payload (Canary device or Canarytoken incident)"""
+    description = {"name": payload.get("CanaryName") or "N/A"}
+    memo = payload.get("Memo") or payload.get("memo")
+    if memo:
+        description["memo"] = memo
+    return {
+        "id": payload.get("IncidentId"), # Not in webhooks, filled in by the next poll
+        "hash_id": payload["IncidentHash"],
+        "summary": payload.get("Description") or payload.get("Title") or "",
+        "description": description,
+    }
+
+class WebhookServer:
+    """Receives console webhooks and hands each incident to on_alert(alert)
+    as the same {"title", "id", "hash"} record polling produces.
+
+    Point a generic webhook on the console at http://<device>:<port>/?token=<token>;
+    requests without the right token are refused. It listens on all
+    interfaces, so a token is required.
+    """
+
+    def __init__(self, on_alert, token, port = 8081):
+        if not token:
+            raise ValueError("WebhookServer needs a token")
+        self.on_alert = on_alert
+        self.port = port
+        self.token = token
+        self.received = 0
+        self._server = None
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                status = server.handle(self.path, self.headers, self.rfile)
+                self.send_response(status)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self._server = ThreadingHTTPServer(('', self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target = self._server.serve_forever, name = 'webhook', daemon = True).start()
+        logger.info(f"Listening for console webhooks on port {self.port}")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+    def handle(self, path, headers, body) -> int:
+        """HTTP status for one webhook request"""
+        if parse_qs(urlparse(path).query).get('token') != [self.token]:
+            return 403
+        length = int(headers.get('Content-Length') or 0)
+        if length <= 0 or length > MAX_BODY:
+            return 400
+        try:
+            payload = json.loads(body.read(length))
+            alert = alert_from_incident(incident_from_webhook(payload))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            logger.exception("Ignoring malformed webhook")
+            return 400
+        self.received += 1
+        try:
+            self.on_alert(alert)
+        except Exception:
+            logger.exception("Webhook alert handler failed")
+            return 500
+        return 200
+
+def send_test(url, name = "TestCanary", summary = "Shared File Opened", incident_hash = "test-incident"):
+    """POST a console-style webhook to url, a stand-in for the console"""
+    payload = {
+        "CanaryName": name,
+        "Description": summary,
+        "IncidentHash": incident_hash,
+        "Intro": f"{summary} on {name}",
+        "SourceIP": "10.0.0.1",
+    }
+    req = urllib.request.Request(url, data = json.dumps(payload).encode(), headers = {'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout = 5) as res:
+        return res.status
+
+if __name__ == '__main__':
+    # Fake a console incident against a running device:
+    #   python webhook.py http://canarygotchi.local:8081/?token=... [hash]
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} URL [INCIDENT_HASH]")
+        sys.exit(1)
+    print(send_test(sys.argv[1], incident_hash = sys.argv[2] if len(sys.argv) > 2 else "test-incident"))